@@ -9,9 +9,9 @@
 // Functionality:
 //   Sets alarm based on earliest event in google calendar.
 //   Refresh button forces an update with google calendar.
-//   Alarm is updated every hour.
+//   Alarm schedule for the next week is updated every two hours, and alarms still go off if the calendar can't be reached.
 //   Cancel button cancels a scheduled alarm and stops alarm checks for the next 24 hours.  Cancel the cancel by clicking refresh.
-//   After alarm is stopped, alarms are disabled for next 8 hours.
+//   After alarm is stopped, alarm checks are disabled for next 8 hours.
 //   Only meetings before noon will trigger the alarm.
 
 // Temboo & Google Calendar/GMail configuration.
@@ -24,7 +24,7 @@
 #define TEMBOO_KEY          "YOUR TEMBOO APPLICATION KEY"
 // Temboo Google calendar credential name:
 #define CALENDAR_CREDENTIALS  "GoogleCalendar"
-// Google calendar ID:
+// Google calendar ID (or several separated by commas, or * for all calendars in your calendar list):
 #define CALENDAR_ID         "YOUR GMAIL ADDRESS"
 // Temboo Gmail credential name:
 #define GMAIL_CREDENTIALS    "GoogleMail"
@@ -46,6 +46,19 @@
 #define ALARM_BUFFER_MINS   60 
 // Minutes to wait before checking for new wake up emails.
 #define ALARM_KEYWORD_MINS  120 
+// Days of alarms to keep in the schedule.
+#define SCHEDULE_DAYS       7
+
+// Status bits of the poll command's response.
+// You don't need to change these values.
+#define POLL_ALARM_FOUND   0x01
+
+// Schedule table values (see schedule.py).
+// You don't need to change these values.
+#define SCHEDULE_ENTRIES    SCHEDULE_DAYS+1
+#define SCHEDULE_UNCHANGED  0xFF
+#define ENTRY_ALARM         0x01
+#define ENTRY_CANCELLED     0x04
 
 // Touchscreen calibration.
 // You don't need to change these values.
@@ -73,10 +86,20 @@ unsigned long lastUpdate = 0;
 int time = 0;
 int alarmTime = -1;
 Process alarmPlayback;
+Process alarmDaemon;
 int alarmNextCheck;
 bool alarmPlaying = false;
 TouchScreen ts = TouchScreen(A3, A2, A1, A0, 300);
 unsigned long mailLastSeen = 0;
+// Alarm schedule table, the days since it was read, and the entry of the next alarm.
+byte scheduleDay[SCHEDULE_ENTRIES];
+byte scheduleHour[SCHEDULE_ENTRIES];
+byte scheduleMinute[SCHEDULE_ENTRIES];
+byte scheduleFlags[SCHEDULE_ENTRIES];
+int scheduleCount = 0;
+unsigned int scheduleVersion = 0;
+int scheduleAge = 0;
+int alarmEntry = -1;
 
 // Setup function, called once to initialize alarm state.
 void setup()
@@ -89,6 +112,9 @@ void setup()
   Tft.setDisplayDirect(UP2DOWN);
   // Display a loading message.
   Tft.drawString("LOADING...", MAX_X-10, 10, 3, CLOCK_COLOR);
+  // Start the daemon which keeps the calendar and mail lookups loaded so they answer quickly.
+  // Lookups still work (just slower) while it starts up.
+  alarmDaemon.runShellCommandAsynchronously("python /mnt/sda1/arduino/www/SmartAlarmClock/alarm_daemon.py > /dev/null 2>&1");
   // Update the time (stored as minute of the day, i.e. a value from 0 to 1440 (24*60)).
   time = get_time();
   // Get time of last seen mail with alarm keyword.
@@ -113,6 +139,7 @@ void loop()
     time = time_add(time, 1);
     // Update the time every day at midnight to fix any drift.
     if (time == 0) {
+      scheduleAge += 1;
       time = get_time();
     }
     // Note there is the chance that a time update might move the time past an alarm or
@@ -130,6 +157,11 @@ void loop()
     // Start alarm if necessary.
     if (time == alarmTime) {
       alarm_start();
+      cancel_alarm_entry();
+    }
+    // Move on to the next alarm of the schedule.
+    if (scheduleVersion != 0) {
+      alarmTime = schedule_alarm();
     }
     // Update display.
     draw_display(time, alarmTime);
@@ -146,8 +178,8 @@ void loop()
   if (p.z > ts.pressureThreshhold && alarmPlaying) {
     // Stop the alarm.
     alarm_stop(); 
-    // Remove the current alarm and stop alarm checks for the next 8 hours.
-    alarmTime = -1;
+    // Move on to the next alarm and stop alarm checks for the next 8 hours.
+    alarmTime = schedule_alarm();
     alarmNextCheck = time_add(time, 8*60);
     // Redraw the display.
     draw_display(time, alarmTime);
@@ -158,12 +190,13 @@ void loop()
     // Highlight the button so it's clear the refresh is happening.
     Tft.fillRectangle(REFRESH_X, REFRESH_Y, BUTTON_HEIGHT, BUTTON_WIDTH, CLOCK_COLOR);
     Tft.drawString("REFRSH", REFRESH_X+30, REFRESH_Y+5, 2, BLACK);
-    // Update time.
-    time = get_time();
-    // Update alarm time.
-    alarmTime = get_alarm();
-    // Check for any mail alarm.
-    check_mail_alarm();
+    // Update time and alarm time and check for any mail alarm, all with one lookup.
+    if (!poll_all()) {
+      // Fall back to the separate lookups if the poll failed.
+      time = get_time();
+      alarmTime = get_alarm();
+      check_mail_alarm();
+    }
     // Redraw the display.
     draw_display(time, alarmTime);
   }
@@ -171,6 +204,7 @@ void loop()
   // Check for cancel button hit.
   if (p.z > ts.pressureThreshhold && p.x >= CANCEL_X && p.x <= (CANCEL_X + BUTTON_HEIGHT) && p.y >= CANCEL_Y && p.y <= (CANCEL_Y + BUTTON_WIDTH)) {
     // Disable the alarm.
+    cancel_alarm_entry();
     alarmTime = -1;
     // Stop alarm updates for the next ~24 hours.
     alarmNextCheck = time_add(time, -1);
@@ -259,42 +293,104 @@ int get_time() {
   return time_to_minutes(hour24, minute);
 }
 
-// Run the find_alarm.py script to search google calendar for the first alarm in the next 24 hours.
+// Run the schedule.py script to update the alarm schedule from google calendar, and return the next alarm
+// in the next 24 hours.  The schedule is only sent when it has changed, and the old schedule is kept if the
+// calendar can't be reached.
 int get_alarm() {
-  Process findAlarm;
-  findAlarm.begin("python");
-  findAlarm.addParameter("/mnt/sda1/arduino/www/SmartAlarmClock/find_alarm.py");
-  findAlarm.addParameter(TEMBOO_ACCOUNT);
-  findAlarm.addParameter(TEMBOO_APP);
-  findAlarm.addParameter(TEMBOO_KEY);
-  findAlarm.addParameter(CALENDAR_CREDENTIALS);
-  findAlarm.addParameter(CALENDAR_ID);
-  findAlarm.run();
-  // Check if an alarm was found and parse the time.
-  int alarm = -1;
-  if (findAlarm.available() >= 2) {
-    int alarmHour24 = int(findAlarm.read()); 
-    int alarmMinute = int(findAlarm.read());
-    alarm = time_to_minutes(alarmHour24, alarmMinute);
-    // Only update alarm if it's earlier than the latest alarm hour.
-    if (alarm < (ALARM_LATEST_HOUR*60)) {
-      // Adjust alarm based on buffer minutes.
-      alarm = time_add(alarm, -ALARM_BUFFER_MINS);
+  Process getSchedule;
+  getSchedule.begin("python");
+  getSchedule.addParameter("/mnt/sda1/arduino/www/SmartAlarmClock/alarm_client.py");
+  getSchedule.addParameter("schedule");
+  getSchedule.addParameter(TEMBOO_ACCOUNT);
+  getSchedule.addParameter(TEMBOO_APP);
+  getSchedule.addParameter(TEMBOO_KEY);
+  getSchedule.addParameter(CALENDAR_CREDENTIALS);
+  getSchedule.addParameter(CALENDAR_ID);
+  getSchedule.addParameter(String(SCHEDULE_DAYS));
+  getSchedule.addParameter(String(ALARM_LATEST_HOUR));
+  getSchedule.addParameter(String(ALARM_BUFFER_MINS));
+  getSchedule.addParameter(String(scheduleVersion));
+  getSchedule.run();
+  read_schedule(getSchedule);
+  alarmNextCheck = time_add(time, ALARM_REFRESH_MINS);
+  return schedule_alarm();
+}
+
+// Read a schedule table from the output of the schedule command.  Returns false (and keeps the old
+// schedule) if there was no table.
+bool read_schedule(Process& process) {
+  // Table starts with an unsigned int version and the number of entries.
+  if (process.available() < 3) {
+    return false;
+  }
+  unsigned int version = (unsigned int)process.read() << 8;
+  version |= process.read();
+  int count = process.read();
+  if (count == SCHEDULE_UNCHANGED) {
+    return true;
+  }
+  // Each entry is the day (after the day the table was made), hour, minute and flags of an alarm.
+  scheduleCount = 0;
+  for (int i = 0; i < count && process.available() >= 4; ++i) {
+    byte day = process.read();
+    byte hour24 = process.read();
+    byte minute = process.read();
+    byte flags = process.read();
+    if (scheduleCount < SCHEDULE_ENTRIES) {
+      scheduleDay[scheduleCount] = day;
+      scheduleHour[scheduleCount] = hour24;
+      scheduleMinute[scheduleCount] = minute;
+      scheduleFlags[scheduleCount] = flags;
+      scheduleCount += 1;
+    }
+  }
+  scheduleVersion = version;
+  scheduleAge = 0;
+  return true;
+}
+
+// Return the time of the next alarm in the schedule in the next 24 hours, or -1 if there is none.
+int schedule_alarm() {
+  alarmEntry = -1;
+  for (int i = 0; i < scheduleCount; ++i) {
+    if (!(scheduleFlags[i] & ENTRY_ALARM) || (scheduleFlags[i] & ENTRY_CANCELLED)) {
+      continue;
     }
-    else {
-      // Alarm is too late in the day to fire.
-      alarm = -1;
+    int alarm = time_to_minutes(scheduleHour[i], scheduleMinute[i]);
+    if ((scheduleDay[i] == scheduleAge && alarm >= time) || (scheduleDay[i] == scheduleAge + 1 && alarm < time)) {
+      alarmEntry = i;
+      return alarm;
     }
   }
-  alarmNextCheck = time_add(time, ALARM_REFRESH_MINS);
-  return alarm;
+  return -1;
+}
+
+// Mark the schedule entry of the current alarm so it doesn't go off (again).
+void cancel_alarm_entry() {
+  if (alarmEntry >= 0) {
+    scheduleFlags[alarmEntry] |= ENTRY_CANCELLED;
+  }
+}
+
+// Return the alarm time for an event starting at the specified hour and minute, or -1 if the event
+// is too late in the day to need an alarm.
+int event_alarm(int hour24, int minute) {
+  int alarm = time_to_minutes(hour24, minute);
+  // Only update alarm if it's earlier than the latest alarm hour.
+  if (alarm < (ALARM_LATEST_HOUR*60)) {
+    // Adjust alarm based on buffer minutes.
+    return time_add(alarm, -ALARM_BUFFER_MINS);
+  }
+  // Alarm is too late in the day to fire.
+  return -1;
 }
 
 // Run the check_mail.py script to check email for most recent unread message with keyword in the title.
 unsigned long get_mail_lastseen() {
   Process checkMail;
   checkMail.begin("python");
-  checkMail.addParameter("/mnt/sda1/arduino/www/SmartAlarmClock/check_email.py");
+  checkMail.addParameter("/mnt/sda1/arduino/www/SmartAlarmClock/alarm_client.py");
+  checkMail.addParameter("check_email");
   checkMail.addParameter(TEMBOO_ACCOUNT);
   checkMail.addParameter(TEMBOO_APP);
   checkMail.addParameter(TEMBOO_KEY);
@@ -315,7 +411,11 @@ unsigned long get_mail_lastseen() {
 
 // Sound the alarm if an email has been received which contains the alarm keyword.
 void check_mail_alarm() {
-  unsigned long lastSeen = get_mail_lastseen();
+  mail_alarm(get_mail_lastseen());
+}
+
+// Sound the alarm if the last seen time of mail with the alarm keyword is newer than before.
+void mail_alarm(unsigned long lastSeen) {
   if (lastSeen > mailLastSeen) {
     // Found a new mail, sound the alarm!
     alarm_start();
@@ -323,6 +423,55 @@ void check_mail_alarm() {
   } 
 }
 
+// Run the poll command to update the time and alarm time and check for a mail alarm with a single
+// lookup, which searches the calendar and checks mail at the same time.  Returns false (and leaves
+// everything as it was) if the poll failed.
+bool poll_all() {
+  Process poll;
+  poll.begin("python");
+  poll.addParameter("/mnt/sda1/arduino/www/SmartAlarmClock/alarm_client.py");
+  poll.addParameter("poll");
+  poll.addParameter(TEMBOO_ACCOUNT);
+  poll.addParameter(TEMBOO_APP);
+  poll.addParameter(TEMBOO_KEY);
+  poll.addParameter(CALENDAR_CREDENTIALS);
+  poll.addParameter(CALENDAR_ID);
+  poll.addParameter(GMAIL_CREDENTIALS);
+  poll.addParameter(GMAIL_ALARM_KEYWORD);
+  poll.addParameter(String(SCHEDULE_DAYS));
+  poll.addParameter(String(ALARM_LATEST_HOUR));
+  poll.addParameter(String(ALARM_BUFFER_MINS));
+  // Always ask for the whole schedule, which also clears any cancelled alarms.
+  poll.addParameter("0");
+  poll.run();
+  // Response is a status byte, alarm hour and minute, unsigned long mail last seen time, and the
+  // current hour and minute, followed by the schedule table.
+  if (poll.available() < 9) {
+    return false;
+  }
+  int status = poll.read();
+  int alarmHour24 = poll.read();
+  int alarmMinute = poll.read();
+  unsigned long lastSeen = 0;
+  lastSeen |= ((unsigned long)poll.read() << 24);
+  lastSeen |= ((unsigned long)poll.read() << 16);
+  lastSeen |= ((unsigned long)poll.read() << 8);
+  lastSeen |= poll.read();
+  int hour24 = poll.read();
+  int minute = poll.read();
+  time = time_to_minutes(hour24, minute);
+  if (read_schedule(poll)) {
+    alarmTime = schedule_alarm();
+  }
+  else {
+    alarmTime = (status & POLL_ALARM_FOUND) ? event_alarm(alarmHour24, alarmMinute) : -1;
+    alarmEntry = -1;
+  }
+  alarmNextCheck = time_add(time, ALARM_REFRESH_MINS);
+  mail_alarm(lastSeen);
+  return true;
+}
+
 // Draw the display for the specified time and alarm time.
 void draw_display(int time, int alarmTime) {
   Tft.paintScreenBlack();
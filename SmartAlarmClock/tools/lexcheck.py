@@ -0,0 +1,208 @@
+# -*- coding:iso-8859-1 -*-
+# Smart Alarm Clock
+# Differential check and benchmark of the date lexer in dateutil.parser.
+# Copyright 2014 Tony DiCola (tony@tonydicola.com)
+# Released under an MIT license (http://opensource.org/licenses/MIT)
+#
+# Usage:
+#   python lexcheck.py [COUNT]
+#
+# Checks that dateutil.parser._timelex splits strings exactly like the character at a time lexer
+# it replaced, over sample date strings and COUNT random strings (default 100000), then times
+# both lexers.  Exits with status 1 if any string splits differently.
+
+import os
+import random
+import sys
+import timeit
+
+try:
+	from cStringIO import StringIO
+except ImportError:
+	from StringIO import StringIO
+
+# The app's vendored dateutil lives in www/.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'www'))
+from dateutil.parser import _timelex
+
+
+class _reftimelex(object):
+	"""The character at a time lexer dateutil.parser._timelex replaced, from dateutil 1.5
+	(Copyright (c) 2003-2007 Gustavo Niemeyer, PSF License)."""
+
+	def __init__(self, instream):
+		if isinstance(instream, basestring):
+			instream = StringIO(instream)
+		self.instream = instream
+		self.wordchars = ('abcdfeghijklmnopqrstuvwxyz'
+			'ABCDEFGHIJKLMNOPQRSTUVWXYZ_'
+			''
+			'')
+		self.numchars = '0123456789'
+		self.whitespace = ' \t\r\n'
+		self.charstack = []
+		self.tokenstack = []
+		self.eof = False
+
+	def get_token(self):
+		if self.tokenstack:
+			return self.tokenstack.pop(0)
+		seenletters = False
+		token = None
+		state = None
+		wordchars = self.wordchars
+		numchars = self.numchars
+		whitespace = self.whitespace
+		while not self.eof:
+			if self.charstack:
+				nextchar = self.charstack.pop(0)
+			else:
+				nextchar = self.instream.read(1)
+				while nextchar == '\x00':
+					nextchar = self.instream.read(1)
+			if not nextchar:
+				self.eof = True
+				break
+			elif not state:
+				token = nextchar
+				if nextchar in wordchars:
+					state = 'a'
+				elif nextchar in numchars:
+					state = '0'
+				elif nextchar in whitespace:
+					token = ' '
+					break # emit token
+				else:
+					break # emit token
+			elif state == 'a':
+				seenletters = True
+				if nextchar in wordchars:
+					token += nextchar
+				elif nextchar == '.':
+					token += nextchar
+					state = 'a.'
+				else:
+					self.charstack.append(nextchar)
+					break # emit token
+			elif state == '0':
+				if nextchar in numchars:
+					token += nextchar
+				elif nextchar == '.':
+					token += nextchar
+					state = '0.'
+				else:
+					self.charstack.append(nextchar)
+					break # emit token
+			elif state == 'a.':
+				seenletters = True
+				if nextchar == '.' or nextchar in wordchars:
+					token += nextchar
+				elif nextchar in numchars and token[-1] == '.':
+					token += nextchar
+					state = '0.'
+				else:
+					self.charstack.append(nextchar)
+					break # emit token
+			elif state == '0.':
+				if nextchar == '.' or nextchar in numchars:
+					token += nextchar
+				elif nextchar in wordchars and token[-1] == '.':
+					token += nextchar
+					state = 'a.'
+				else:
+					self.charstack.append(nextchar)
+					break # emit token
+		if (state in ('a.', '0.') and
+				(seenletters or token.count('.') > 1 or token[-1] == '.')):
+			l = token.split('.')
+			token = l[0]
+			for tok in l[1:]:
+				self.tokenstack.append('.')
+				if tok:
+					self.tokenstack.append(tok)
+		return token
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		token = self.get_token()
+		if token is None:
+			raise StopIteration
+		return token
+
+	def split(cls, s):
+		return list(cls(s))
+	split = classmethod(split)
+
+
+# Strings that exercise the lexer's rules, e.g. the 'a.' and '0.' splits.
+SAMPLES = ['2014-05-20T08:30:00-07:00', 'Thu Sep 25 10:36:28 BRST 2003',
+	'Wed, 21 May 2014 15:30:00 +0000', 'May 20, 2014 8:30 AM',
+	'2003-09-25T10:49:41.5-03:00', '19970902T090000',
+	'EST5EDT,M3.2.0/2,M11.1.0/2', 'UTC+3', '12:00 p.m.', '8.30am',
+	'10.5.2014', '3.2.', 'a.m.', 'p.m', '1.a', '1.a ', 'a.1b', '1.a2',
+	'1.b.c', 'abc.def.1.2.ghi', '...', '1..2', 'a..b', 'x_y.z_',
+	'\xe9t\xe9 20', 'a\x00b', '\t\r\n', ' ', '', u'May 20']
+
+# Characters the random strings are made of: one or more of each class the
+# lexer tells apart.
+ALPHABET = 'aZ_\xe9\xd710 .:-,/+\t\x00'
+
+# Strings the benchmark splits.
+BENCHMARK = ['Thu Sep 25 10:36:28 BRST 2003', '2014-05-20T08:30:00-07:00',
+	'Wed, 21 May 2014 15:30:00 +0000']
+
+
+def corpus(count, seed=1):
+	"""Return SAMPLES followed by count random strings of up to 14
+	characters from ALPHABET."""
+	rand = random.Random(seed)
+	strings = list(SAMPLES)
+	for i in range(count):
+		strings.append(''.join([rand.choice(ALPHABET) for j in range(rand.randint(0, 14))]))
+	return strings
+
+
+def check(strings):
+	"""Return a list of (string, expected, got) for the strings which
+	_timelex splits differently (or into tokens of other types) than
+	_reftimelex, whether given as a string or as a stream."""
+	mismatches = []
+	for s in strings:
+		expected = _reftimelex.split(s)
+		got = _timelex.split(s)
+		if got == expected and isinstance(s, str):
+			got = _timelex.split(StringIO(s))
+		if got != expected or map(type, got) != map(type, expected):
+			mismatches.append((s, expected, got))
+	return mismatches
+
+
+def benchmark(strings=BENCHMARK, number=20000):
+	"""Return a list of (string, reference, current) with the average
+	microseconds each lexer takes to split each of the strings."""
+	times = []
+	for s in strings:
+		ref = timeit.Timer(lambda: _reftimelex.split(s)).timeit(number)
+		cur = timeit.Timer(lambda: _timelex.split(s)).timeit(number)
+		times.append((s, ref/number*1e6, cur/number*1e6))
+	return times
+
+
+def main(argv):
+	count = 100000
+	if len(argv) > 1:
+		count = int(argv[1])
+	strings = corpus(count)
+	mismatches = check(strings)
+	for s, expected, got in mismatches[:10]:
+		print "%r: expected %r, got %r" % (s, expected, got)
+	print "%d strings, %d mismatches" % (len(strings), len(mismatches))
+	for s, ref, cur in benchmark():
+		print "%-34s %6.1f us -> %5.1f us (x%.1f)" % (s, ref, cur, ref/cur)
+	return mismatches and 1 or 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv))
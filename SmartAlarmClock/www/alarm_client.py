@@ -0,0 +1,61 @@
+# Smart Alarm Clock
+# Client for the alarm daemon, a drop-in replacement for running the lookup scripts directly.
+# Copyright 2014 Tony DiCola (tony@tonydicola.com)
+# Released under an MIT license (http://opensource.org/licenses/MIT)
+#
+# Usage:
+#   python alarm_client.py find_alarm|check_email|poll|schedule ARGS...
+#
+# Takes the same arguments and gives the same output and exit status as find_alarm.py,
+# check_email.py, poll.py or schedule.py.  The lookup is answered by alarm_daemon.py if it is
+# running, and otherwise by running the script as usual.  Only small standard modules are imported
+# here so the client itself starts quickly.
+
+import json
+import os
+import socket
+import sys
+
+
+SOCKET_PATH = '/tmp/smartalarmclock.sock'
+COMMANDS = ('find_alarm', 'check_email', 'poll', 'schedule')
+
+
+def request(command, args, path=SOCKET_PATH, timeout=60):
+	"""Ask the daemon to run command with the script arguments args.  Returns an (exit status,
+	output) tuple, or None if the daemon isn't running."""
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	sock.settimeout(timeout)
+	try:
+		try:
+			sock.connect(path)
+		except socket.error:
+			return None
+		sock.sendall(json.dumps([command] + list(args)) + '\n')
+		# The response is the exit status on its own line, then the output until the daemon hangs up.
+		chunks = []
+		while True:
+			chunk = sock.recv(4096)
+			if not chunk:
+				break
+			chunks.append(chunk)
+	finally:
+		sock.close()
+	status, output = ''.join(chunks).split('\n', 1)
+	return int(status), output
+
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+		sys.exit(1)
+	command = sys.argv[1]
+	try:
+		response = request(command, sys.argv[2:])
+	except (socket.error, ValueError):
+		response = None
+	if response is None:
+		# No daemon (or it went away), run the script in this process instead.
+		script = os.path.join(os.path.dirname(os.path.abspath(__file__)), command + '.py')
+		os.execv(sys.executable, [sys.executable, script] + sys.argv[2:])
+	sys.stdout.write(response[1])
+	sys.exit(response[0])
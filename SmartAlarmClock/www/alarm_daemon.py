@@ -0,0 +1,97 @@
+# Smart Alarm Clock
+# Daemon keeping the alarm and mail lookups loaded, so each lookup skips interpreter startup and
+# module imports and reuses Temboo sessions' pooled connections.
+# Copyright 2014 Tony DiCola (tony@tonydicola.com)
+# Released under an MIT license (http://opensource.org/licenses/MIT)
+#
+# Usage:
+#   python alarm_daemon.py [--socket PATH]
+#
+# Lookups are then made with alarm_client.py.  Only one daemon runs at a time, starting another
+# while one is listening on the socket just exits.
+
+import json
+import optparse
+import os
+import signal
+import socket
+import SocketServer
+import sys
+import traceback
+from StringIO import StringIO
+
+import check_email
+import fallback
+import find_alarm
+import poll
+import schedule
+from alarm_client import SOCKET_PATH
+
+
+COMMANDS = {'find_alarm': find_alarm.main, 'check_email': check_email.main, 'poll': poll.main,
+	'schedule': schedule.main}
+
+
+class DaemonHandler(SocketServer.StreamRequestHandler):
+	"""Runs one lookup per connection, see alarm_client.request for the protocol."""
+
+	def handle(self):
+		line = self.rfile.readline()
+		if not line:
+			# Just a check that the daemon is running.
+			return
+		try:
+			request = [str(arg) for arg in json.loads(line)]
+			main = COMMANDS[request[0]]
+		except (ValueError, TypeError, IndexError, KeyError, UnicodeError):
+			self.wfile.write('1\n')
+			return
+		out = StringIO()
+		try:
+			status = main([request[0] + '.py'] + request[1:], out, sys.stderr)
+		except Exception:
+			# Report the failure like the script would have, and keep serving.
+			traceback.print_exc()
+			status = 1
+			out = StringIO()
+		self.wfile.write('{0}\n'.format(status) + out.getvalue())
+
+
+class Daemon(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	"""Threaded Unix socket server, so a slow lookup doesn't hold up the other."""
+	daemon_threads = True
+
+
+def is_running(path):
+	"""Return true if a daemon is already listening on the socket at path."""
+	probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		probe.connect(path)
+		return True
+	except socket.error:
+		return False
+	finally:
+		probe.close()
+
+
+if __name__ == '__main__':
+	parser = optparse.OptionParser(usage='%prog [options]')
+	parser.add_option('--socket', default=SOCKET_PATH, help='Unix socket to listen on (default {0})'.format(SOCKET_PATH))
+	options, args = parser.parse_args()
+	if is_running(options.socket):
+		sys.exit(0)
+	if os.path.exists(options.socket):
+		# Left behind by a daemon that didn't shut down cleanly.
+		os.remove(options.socket)
+	# Refresh in threads, so refreshes share this process's sessions and connections.
+	fallback.USE_FORK = False
+	server = Daemon(options.socket, DaemonHandler)
+	os.chmod(options.socket, 0600)
+	# Clean up the socket when stopped with kill too.
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		os.remove(options.socket)
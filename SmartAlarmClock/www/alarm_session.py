@@ -0,0 +1,32 @@
+# Smart Alarm Clock
+# Temboo session setup shared by the alarm scripts.
+# Copyright 2014 Tony DiCola (tony@tonydicola.com)
+# Released under an MIT license (http://opensource.org/licenses/MIT)
+
+import os
+
+import standin_options
+from temboo.core.ratelimit import RateLimiter
+from temboo.core.retry import RetryPolicy
+from temboo.core.session import TembooSession
+from temboo.core.tokencache import TokenCache
+
+
+# Most choreo executions allowed per hour, in bursts of up to as many.  The allowance is
+# shared by every script (and any other process on the Yun using the account).
+ACCOUNT_LIMIT = (30, 3600)
+
+# Keep the OAuth tokens Temboo refreshes next to the scripts, in a directory only this user can read.
+TOKEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tokens', 'tokens.json')
+
+
+def new_session(temboo_account, temboo_app, temboo_key, reuse_tokens=False):
+	"""Return a TembooSession for the alarm scripts.  Dropped requests are retried, but given up
+	in time to answer from the last good response instead, and bursts beyond the account's hourly
+	allowance fail straight away to be answered the same way.  With reuse_tokens the OAuth tokens
+	Temboo refreshes are kept and reused until they expire, instead of refreshed every call."""
+	options = standin_options.session_options()
+	if reuse_tokens:
+		options['token_cache'] = TokenCache(path=TOKEN_FILE)
+	return TembooSession(temboo_account, temboo_app, temboo_key, retry_policy=RetryPolicy(deadline=8),
+		rate_limiter=RateLimiter(account_limit=ACCOUNT_LIMIT, block=False), **options)
@@ -3,25 +3,26 @@
 # Copyright 2014 Tony DiCola (tony@tonydicola.com)
 # Released under an MIT license (http://opensource.org/licenses/MIT)
 
-import json
 import struct
 import sys
 import time
 
+import alarm_session
 import dateutil.parser
+import fallback
 from temboo.core.session import *
 from temboo.Library.Google.Gmail import *
 
 
 def get_unread(temboo_account, temboo_app, temboo_key, temboo_credentials):
-	"""Grab feed of unread emails from Gmail."""
-	session = TembooSession(temboo_account, temboo_app, temboo_key)
+	"""Grab feed of unread emails from Gmail and return the parsed JSON response."""
+	session = alarm_session.new_session(temboo_account, temboo_app, temboo_key)
 	choreo = InboxFeed(session)
 	inputs = choreo.new_input_set()
 	inputs.set_credential(temboo_credentials)
 	inputs.set_ResponseFormat('json')
-	result = choreo.execute_with_results(inputs)
-	return result.get_Response()
+	result = choreo.execute_with_results(inputs, lazy=True)
+	return result.get_json('Response')
 
 def entry_has_keyword(keyword):
 	"""Return a function that will filter (i.e. return true) if the provided entry has the given keyword in its title."""
@@ -36,36 +37,50 @@ def entry_has_keyword(keyword):
 		return title.find(keyword) > -1
 	return filter_function
 
-def respond(lastseen):
-	"""Print the last seen time (seconds since epoch) as an unsigned long value and quit."""
-	print struct.pack('L', lastseen)
-	sys.exit(0)
-
-if __name__ == '__main__':
-	# Parse parameters from command line.
-	if len(sys.argv) != 6:
-		# Not enough parameters, quit!
-		sys.exit(1)
-	temboo_account = sys.argv[1]
-	temboo_app = sys.argv[2]
-	temboo_key = sys.argv[3]
-	temboo_credentials = sys.argv[4]
-	keyword = sys.argv[5]
-	# Search calendar for events.
-	response = get_unread(temboo_account, temboo_app, temboo_key, temboo_credentials)
-	# Parse events from response.
-	data = json.loads(response)
+def latest_mail(temboo_account, temboo_app, temboo_key, temboo_credentials, keyword, err=sys.stderr):
+	"""Find the most recent unread mail with the keyword in its title.  Returns a tuple of the
+	fallback.LastGood feed answer (None if there's no answer at all) and the mail's time in seconds
+	since epoch (0 if there's no such mail)."""
+	# Grab unread mail, answering from the last good feed if the network is down or slow.
+	answer = fallback.fetch('check_email ' + temboo_credentials,
+		lambda: get_unread(temboo_account, temboo_app, temboo_key, temboo_credentials))
+	if answer is None:
+		return None, 0
+	if answer.age > 60:
+		err.write('Using mail feed from {0:.0f} seconds ago.\n'.format(answer.age))
+	# Entries from the (already parsed) response.
+	data = answer.response
 	if data is None:
-		respond(0)
+		return answer, 0
 	# Grab the issued date of every entry which has the desired keyword in its title.
 	entry = data.get('entry')
 	if entry is None:
-		respond(0)
+		return answer, 0
 	dates = map(lambda e: e.get('issued'), filter(entry_has_keyword(keyword), entry))
 	# Parse string to datetime and sort in ascending order.
 	dates = sorted(map(dateutil.parser.parse, dates))
 	# Stop if no dates were found.
 	if len(dates) < 1:
-		respond(0)
+		return answer, 0
 	# Else return the time (in seconds since epoch) for the most recent date.
-	respond(time.mktime(dates[-1].timetuple()))
+	return answer, time.mktime(dates[-1].timetuple())
+
+def respond(out, lastseen):
+	"""Write the last seen time (seconds since epoch) to out as an unsigned long value and return
+	the exit status."""
+	out.write(struct.pack('L', lastseen) + '\n')
+	return 0
+
+def main(argv, out=sys.stdout, err=sys.stderr):
+	"""Look for the latest unread mail with the keyword using the command line arguments in argv and
+	write its time to out.  Returns the exit status for the script."""
+	# Parse parameters from command line.
+	if len(argv) != 6:
+		# Not enough parameters, quit!
+		return 1
+	answer, lastseen = latest_mail(argv[1], argv[2], argv[3], argv[4], argv[5], err)
+	return respond(out, lastseen)
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
@@ -10,20 +10,18 @@ __license__ = "PSF License"
 
 import datetime
 import string
+import re
 import time
 import sys
 import os
-
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
+import threading
+from collections import namedtuple
 
 import relativedelta
 import tz
 
 
-__all__ = ["parse", "parserinfo"]
+__all__ = ["parse", "isoparse", "parserinfo"]
 
 
 # Some pointers:
@@ -38,97 +36,63 @@ __all__ = ["parse", "parserinfo"]
 
 class _timelex(object):
 
+    wordchars = ('abcdfeghijklmnopqrstuvwxyz'
+                 'ABCDEFGHIJKLMNOPQRSTUVWXYZ_'
+                 ''
+                 '')
+    numchars = '0123456789'
+    whitespace = ' \t\r\n'
+
+    # A run of word or number characters, which carries on past a '.' with
+    # a run of either (e.g. "8.30am" or "a.m."), or any single character.
+    _word = '[%s]' % re.escape(wordchars)
+    _number = '[%s]' % numchars
+    _token = re.compile(r"(?:%s+|%s+)(?:\.(?:%s+|%s+)?)*|." %
+                        (_word, _number, _word, _number), re.S)
+    _wordchar = re.compile(_word)
+
     def __init__(self, instream):
-        if isinstance(instream, basestring):
-            instream = StringIO(instream)
-        self.instream = instream
-        self.wordchars = ('abcdfeghijklmnopqrstuvwxyz'
-                          'ABCDEFGHIJKLMNOPQRSTUVWXYZ_'
-                          ''
-                          '')
-        self.numchars = '0123456789'
-        self.whitespace = ' \t\r\n'
-        self.charstack = []
-        self.tokenstack = []
-        self.eof = False
+        self.tokenstack = self._tokenize(instream)
+        self.tokenstack.reverse()
+
+    def _tokenize(cls, instream):
+        if not isinstance(instream, basestring):
+            instream = instream.read()
+        if isinstance(instream, unicode):
+            # Like reading it through cStringIO.
+            instream = instream.encode('ascii')
+        s = instream.replace('\x00', '')
+        tokens = cls._token.findall(s)
+        if '\t' in s or '\r' in s or '\n' in s:
+            whitespace = cls.whitespace
+            tokens = [tok in whitespace and ' ' or tok for tok in tokens]
+        if '.' not in s:
+            return tokens
+        # Split dotted tokens (e.g. "a.m." or "1.2.3", but not "8.30") on
+        # their dots.  Letters count as seen once a character follows the
+        # first of them, which only fails at the end of the string.
+        result = []
+        last = len(tokens)-1
+        for i, token in enumerate(tokens):
+            if '.' in token and token[0] != '.':
+                first = cls._wordchar.search(token)
+                if ((first and (i < last or first.end() < len(token))) or
+                    token.count('.') > 1 or token[-1] == '.'):
+                    l = token.split('.')
+                    result.append(l[0])
+                    for tok in l[1:]:
+                        result.append('.')
+                        if tok:
+                            result.append(tok)
+                    continue
+            result.append(token)
+        return result
+    _tokenize = classmethod(_tokenize)
 
     def get_token(self):
         if self.tokenstack:
-            return self.tokenstack.pop(0)
-        seenletters = False
-        token = None
-        state = None
-        wordchars = self.wordchars
-        numchars = self.numchars
-        whitespace = self.whitespace
-        while not self.eof:
-            if self.charstack:
-                nextchar = self.charstack.pop(0)
-            else:
-                nextchar = self.instream.read(1)
-                while nextchar == '\x00':
-                    nextchar = self.instream.read(1)
-            if not nextchar:
-                self.eof = True
-                break
-            elif not state:
-                token = nextchar
-                if nextchar in wordchars:
-                    state = 'a'
-                elif nextchar in numchars:
-                    state = '0'
-                elif nextchar in whitespace:
-                    token = ' '
-                    break # emit token
-                else:
-                    break # emit token
-            elif state == 'a':
-                seenletters = True
-                if nextchar in wordchars:
-                    token += nextchar
-                elif nextchar == '.':
-                    token += nextchar
-                    state = 'a.'
-                else:
-                    self.charstack.append(nextchar)
-                    break # emit token
-            elif state == '0':
-                if nextchar in numchars:
-                    token += nextchar
-                elif nextchar == '.':
-                    token += nextchar
-                    state = '0.'
-                else:
-                    self.charstack.append(nextchar)
-                    break # emit token
-            elif state == 'a.':
-                seenletters = True
-                if nextchar == '.' or nextchar in wordchars:
-                    token += nextchar
-                elif nextchar in numchars and token[-1] == '.':
-                    token += nextchar
-                    state = '0.'
-                else:
-                    self.charstack.append(nextchar)
-                    break # emit token
-            elif state == '0.':
-                if nextchar == '.' or nextchar in numchars:
-                    token += nextchar
-                elif nextchar in wordchars and token[-1] == '.':
-                    token += nextchar
-                    state = 'a.'
-                else:
-                    self.charstack.append(nextchar)
-                    break # emit token
-        if (state in ('a.', '0.') and
-            (seenletters or token.count('.') > 1 or token[-1] == '.')):
-            l = token.split('.')
-            token = l[0]
-            for tok in l[1:]:
-                self.tokenstack.append('.')
-                if tok:
-                    self.tokenstack.append(tok)
-        return token
+            return self.tokenstack.pop()
+        return None
 
     def __iter__(self):
         return self
@@ -140,7 +104,7 @@ class _timelex(object):
         return token
 
     def split(cls, s):
-        return list(cls(s))
+        return cls._tokenize(s)
     split = classmethod(split)
 
 
@@ -287,20 +251,121 @@ class parserinfo(object):
         return True
 
 
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class _lrucache(object):
+    """A mapping of at most maxsize items, which drops the least recently
+    used item to make room for a new one."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data = {}
+        # Circular list of [prev, next, key, value] links, most recently
+        # used last.
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            link = self._data.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            prev, next, key, value = link
+            prev[1] = next
+            next[0] = prev
+            root = self._root
+            last = root[0]
+            last[1] = root[0] = link
+            link[0] = last
+            link[1] = root
+            return value
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        self._lock.acquire()
+        try:
+            if key in self._data:
+                self._data[key][3] = value
+                return
+            root = self._root
+            if len(self._data) >= self.maxsize:
+                oldest = root[1]
+                root[1] = oldest[1]
+                oldest[1][0] = root
+                del self._data[oldest[2]]
+            last = root[0]
+            link = [last, root, key, value]
+            last[1] = root[0] = self._data[key] = link
+        finally:
+            self._lock.release()
+
+
 class parser(object):
 
-    def __init__(self, info=None):
+    def __init__(self, info=None, cache_size=0):
         self.info = info or parserinfo()
+        self._cache = None
+        self.set_cache_size(cache_size)
+
+    def set_cache_size(self, cache_size):
+        """Keep the intermediate results of up to cache_size strings (with
+        their parse options), so parsing them again skips the lexer and
+        heuristics.  A cache_size of 0 (the default) disables the cache.
+        Cached results and statistics are dropped."""
+        if cache_size > 0:
+            self._cache = _lrucache(cache_size)
+        else:
+            self._cache = None
+
+    def cache_info(self):
+        """Return the cache's hits, misses, maxsize and currsize."""
+        cache = self._cache
+        if cache is None:
+            return CacheInfo(0, 0, 0, 0)
+        return CacheInfo(cache.hits, cache.misses, cache.maxsize, len(cache))
 
     def parse(self, timestr, default=None,
                     ignoretz=False, tzinfos=None,
                     **kwargs):
-        if not default:
-            default = datetime.datetime.now().replace(hour=0, minute=0,
-                                                      second=0, microsecond=0)
-        res = self._parse(timestr, **kwargs)
+        if (not default and not ignoretz and not tzinfos and not kwargs
+            and self.info.__class__ is parserinfo):
+            # Strict ISO 8601 strings give the same result without the
+            # lexer and heuristics.
+            ret = _isoparse(timestr)
+            if ret is not None:
+                return ret
+        cache = self._cache
+        if cache is not None and isinstance(timestr, basestring):
+            # Results are cached before default and tzinfos are applied.
+            key = (timestr, tuple(sorted(kwargs.items())))
+            res = cache.get(key, _MISSING)
+            if res is _MISSING:
+                res = self._parse(timestr, **kwargs)
+                cache.set(key, res)
+        else:
+            res = self._parse(timestr, **kwargs)
         if res is None:
             raise ValueError, "unknown string format"
+        if not default:
+            if (res.year is not None and res.month is not None and
+                res.day is not None):
+                # None of today's date would be used.
+                default = datetime.datetime(res.year, res.month, res.day)
+            else:
+                default = datetime.datetime.now().replace(hour=0, minute=0,
+                                                          second=0,
+                                                          microsecond=0)
         repl = {}
         for attr in ["year", "month", "day", "hour",
                      "minute", "second", "microsecond"]:
@@ -689,6 +754,8 @@ class parser(object):
             return None
         return res
 
+_MISSING = object()
+
 DEFAULTPARSER = parser()
 def parse(timestr, parserinfo=None, **kwargs):
     if parserinfo:
@@ -697,6 +764,53 @@ def parse(timestr, parserinfo=None, **kwargs):
         return DEFAULTPARSER.parse(timestr, **kwargs)
 
 
+_ISOFORMAT = re.compile(r"(\d{4})-(\d{2})-(\d{2})"
+                        r"(?:T(\d{2}):(\d{2})(?::(\d{2})(?:[.,](\d+))?)?"
+                        r"(Z|[+-]\d{2}(?::?\d{2})?)?)?$")
+_ISOUTC = tz.tzutc()
+_ISOOFFSETS = {}
+
+def _isoparse(timestr):
+    if not isinstance(timestr, basestring):
+        return None
+    match = _ISOFORMAT.match(timestr)
+    if match is None:
+        return None
+    (year, month, day, hour, minute,
+     second, fraction, offset) = match.groups()
+    if offset is None:
+        tzinfo = None
+    elif offset == "Z":
+        tzinfo = _ISOUTC
+    else:
+        tzinfo = _ISOOFFSETS.get(offset)
+        if tzinfo is None:
+            seconds = int(offset[1:3])*3600
+            if len(offset) > 3:
+                seconds += int(offset[-2:])*60
+            if offset[0] == "-":
+                seconds = -seconds
+            tzinfo = seconds and tz.tzoffset(None, seconds) or _ISOUTC
+            _ISOOFFSETS[offset] = tzinfo
+    try:
+        return datetime.datetime(int(year), int(month), int(day),
+                                 int(hour or 0), int(minute or 0),
+                                 int(second or 0),
+                                 fraction and int(fraction.ljust(6, "0")[:6])
+                                 or 0, tzinfo)
+    except ValueError:
+        return None
+
+def isoparse(timestr):
+    """Parse a strict ISO 8601 (e.g. RFC 3339) date or date and time,
+    like "2014-05-20" or "2014-05-20T08:30:00.000-07:00".  A "Z" or
+    numeric offset gives an aware datetime, otherwise it is naive."""
+    ret = _isoparse(timestr)
+    if ret is None:
+        raise ValueError, "not an ISO 8601 date and time: %r" % (timestr,)
+    return ret
+
+
 class _tzparser(object):
 
     class _result(_resultbase):
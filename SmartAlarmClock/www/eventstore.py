@@ -0,0 +1,149 @@
+# Smart Alarm Clock
+# Local calendar event store kept up to date by incremental syncs.
+# Copyright 2014 Tony DiCola (tony@tonydicola.com)
+# Released under an MIT license (http://opensource.org/licenses/MIT)
+
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
+
+try:
+	import fcntl
+except ImportError:
+	# Without fcntl (e.g. on Windows) concurrent syncs aren't kept apart.
+	fcntl = None
+
+import dateutil.parser
+import dateutil.tz
+from temboo.core.util import save_json
+
+
+# Keep stores next to the scripts (on the SD card) so they survive a reboot.
+STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'events')
+
+# Full syncs fetch this many days of events, and are repeated once less than a day of that is left
+# (events only come into an incremental sync when they change, not when they come into range).
+HORIZON_DAYS = 7
+
+# Incremental syncs fetch changes since the latest modification time seen, less this margin for
+# changes saved at the same time.  Changes fetched twice are simply applied twice.
+WATERMARK_MARGIN = timedelta(minutes=1)
+
+# Incremental syncs only fetch events starting before the horizon plus this margin, so that a
+# changed recurring event doesn't bring in every one of its future instances.  Events moved out
+# further than this are dropped at the next full sync.
+MOVED_MARGIN = timedelta(days=HORIZON_DAYS)
+
+# Change this when the store's format changes, to force a full sync.
+VERSION = 1
+
+
+def timestamp(value):
+	"""Format an aware datetime as an RFC 3339 timestamp in UTC."""
+	return value.astimezone(dateutil.tz.tzutc()).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+def _start(event):
+	"""Return the start dateTime string of the calendar event, or None for all day events."""
+	return (event.get('start') or {}).get('dateTime')
+
+
+class TooManyChanges(Exception):
+	"""Raised by a sync's fetch when an incremental sync has more changes than are worth fetching,
+	to do a full sync instead."""
+
+
+class EventStore(object):
+	"""Start times of a calendar's upcoming (not all day) events, saved on disk.  The store is
+	filled by a full sync of the next HORIZON_DAYS days, then kept up to date by incremental
+	syncs that only fetch the events modified (or deleted) since the last sync."""
+	def __init__(self, calendar_id, directory=STORE_DIR):
+		self.directory = directory
+		self.path = os.path.join(directory, hashlib.sha1(calendar_id).hexdigest() + '.json')
+
+	def _load(self):
+		try:
+			with open(self.path) as f:
+				state = json.load(f)
+			if state.get('version') == VERSION:
+				return state
+		except (IOError, OSError, ValueError):
+			pass
+		return None
+
+	def _save(self, state):
+		save_json(self.path, state, separators=(',', ':'))
+
+	def _apply(self, state, changes, horizon, now):
+		events = state['events']
+		watermark = None
+		for event in changes:
+			if event.get('updated'):
+				updated = dateutil.parser.parse(event['updated'])
+				watermark = updated if watermark is None else max(watermark, updated)
+			start = _start(event)
+			if event.get('status') == 'cancelled' or start is None or dateutil.parser.parse(start) > horizon:
+				events.pop(event.get('id'), None)
+			else:
+				events[event.get('id')] = start
+		if watermark is not None:
+			state['watermark'] = timestamp(watermark - WATERMARK_MARGIN)
+		elif state['watermark'] is None:
+			state['watermark'] = timestamp(now - WATERMARK_MARGIN)
+
+	def sync(self, fetch, now=None):
+		"""Bring the store up to date.  Fetch is called as fetch(min_time, max_time, last_modified)
+		and returns an iterable of the calendar's events (parsed from JSON) which end after
+		min_time, start before max_time and were modified after the last_modified timestamp (all
+		events when None), including deleted ones.  An incremental sync's fetch can raise
+		TooManyChanges to do a full sync instead.  Returns True if a full sync was done.  Nothing
+		is saved if fetch raises any other error."""
+		if now is None:
+			now = datetime.now(dateutil.tz.tzutc())
+		if not os.path.isdir(self.directory):
+			os.makedirs(self.directory)
+		# Hold a lock so syncs from other processes (or daemon threads) don't interleave.
+		with open(self.path + '.lock', 'w') as lock:
+			if fcntl is not None:
+				fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+			state = self._load()
+			full = state is None or dateutil.parser.parse(state['horizon']) - now < timedelta(days=1)
+			if not full:
+				horizon = dateutil.parser.parse(state['horizon'])
+				try:
+					# Events moved out just past the horizon still show up, to be dropped.
+					self._apply(state, fetch(now, horizon + MOVED_MARGIN, state['watermark']), horizon, now)
+				except TooManyChanges:
+					full = True
+			if full:
+				horizon = now + timedelta(days=HORIZON_DAYS)
+				state = {'version': VERSION, 'horizon': timestamp(horizon), 'watermark': None, 'events': {}}
+				self._apply(state, fetch(now, horizon, None), horizon, now)
+			events = state['events']
+			# Forget events which have already started.
+			for id in [id for id, start in events.items() if dateutil.parser.parse(start) <= now]:
+				del events[id]
+			self._save(state)
+		return full
+
+	def horizon(self):
+		"""Return the aware datetime up to which the store holds every event, or None if it hasn't
+		been synced yet."""
+		state = self._load()
+		if state is None:
+			return None
+		return dateutil.parser.parse(state['horizon'])
+
+	def upcoming(self, start, end, max_events=None):
+		"""Return a list of the stored events (as dicts with 'id' and 'start' like the calendar's
+		events) which start after the aware datetime start and before end, earliest first."""
+		state = self._load()
+		if state is None:
+			return []
+		found = []
+		for id, value in state['events'].items():
+			when = dateutil.parser.parse(value)
+			if start < when < end:
+				found.append((when, {'id': id, 'start': {'dateTime': value}}))
+		found.sort(key=lambda item: item[0])
+		return [event for when, event in found[:max_events]]
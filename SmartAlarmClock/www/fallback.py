@@ -0,0 +1,92 @@
+# Smart Alarm Clock
+# Last good response store for offline fallback.
+# Copyright 2014 Tony DiCola (tony@tonydicola.com)
+# Released under an MIT license (http://opensource.org/licenses/MIT)
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from temboo.core.util import save_json
+
+
+# Keep responses next to the scripts (on the SD card) so they survive a reboot.
+STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lastgood')
+
+# Refresh in a forked child so the refresh outlives a short-lived script.  Long-running processes
+# (like alarm_daemon.py) turn this off to refresh in a thread instead, which keeps the process's
+# sessions and pooled connections in use.
+USE_FORK = hasattr(os, 'fork')
+
+
+class LastGood(object):
+	"""A stored response and the time (seconds since epoch) it was saved."""
+	def __init__(self, response, saved):
+		self.response = response
+		self.saved = saved
+
+	@property
+	def age(self):
+		"""Seconds since the response was fetched."""
+		return max(0, time.time() - self.saved)
+
+def _filename(key, directory):
+	return os.path.join(directory, hashlib.sha1(key).hexdigest() + '.json')
+
+def load(key, directory=STORE_DIR):
+	"""Return the last good response saved for key as a LastGood instance, or None."""
+	try:
+		with open(_filename(key, directory)) as f:
+			data = json.load(f)
+		return LastGood(data['response'], data['saved'])
+	except (IOError, OSError, ValueError, KeyError):
+		return None
+
+def save(key, response, directory=STORE_DIR):
+	"""Save response as the last good response for key."""
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+	save_json(_filename(key, directory), {'response': response, 'saved': time.time()})
+
+def fetch(key, func, timeout=10, directory=STORE_DIR):
+	"""Call func to fetch a fresh response for key, falling back to the last good response.
+	The fetch runs in a forked child process so that when the network is slow or down
+	the caller can answer from the store after timeout seconds, while the child keeps
+	going in the background and updates the store once the network comes back.
+	Returns a LastGood instance (with an age near zero when the fetch succeeded in time),
+	or None if the fetch failed and nothing was stored yet."""
+	if not USE_FORK:
+		return _fetch_thread(key, func, timeout, directory)
+	pid = os.fork()
+	if pid == 0:
+		# Child process, detach from the caller's output so it isn't kept waiting on us.
+		devnull = os.open(os.devnull, os.O_RDWR)
+		for fd in (0, 1, 2):
+			os.dup2(devnull, fd)
+		try:
+			save(key, func(), directory)
+			os._exit(0)
+		except:
+			os._exit(1)
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		done, status = os.waitpid(pid, os.WNOHANG)
+		if done:
+			break
+		time.sleep(0.05)
+	return load(key, directory)
+
+def _fetch_thread(key, func, timeout, directory):
+	"""Refresh in a thread instead of a child process, the refresh only lives as long as the caller."""
+	def refresh():
+		try:
+			save(key, func(), directory)
+		except:
+			pass
+	thread = threading.Thread(target=refresh)
+	thread.daemon = True
+	thread.start()
+	thread.join(timeout)
+	return load(key, directory)
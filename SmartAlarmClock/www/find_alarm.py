@@ -4,29 +4,147 @@
 # Released under an MIT license (http://opensource.org/licenses/MIT)
 
 from datetime import datetime, timedelta
-import json
+import heapq
+import itertools
 import struct
 import sys
 
+import alarm_session
 import dateutil.parser
+import dateutil.tz
+import eventstore
+import fallback
+from temboo.core.batch import ChoreoBatch
+from temboo.core.exception import TembooPageLimitError
+from temboo.core.pagination import paginate
 from temboo.core.session import *
 from temboo.Library.Google.Calendar import *
 
 
-def search_events(start_utc, end_utc, temboo_account, temboo_app, temboo_key, temboo_credentials, calendar_id):
-	"""Execute the calendar event search choreo on Temboo and return the raw JSON response.
-	Start_utc and end_utc values are python dates (in UTC) to limit the search for events."""
-	session = TembooSession(temboo_account, temboo_app, temboo_key)
+# Events requested per page while syncing the calendar's event store.
+SYNC_PAGE_SIZE = 50
+# Most pages of changes an incremental sync fetches before doing a full sync instead (which only
+# fetches the store's few days of events).
+SYNC_MAX_PAGES = 2
+
+# Calendar ID which stands for all of the calendars in the account's calendar list.
+ALL_CALENDARS = '*'
+# Seconds to reuse the calendar list found for ALL_CALENDARS before asking for it again.
+DISCOVERY_SECONDS = 24*60*60
+DISCOVERY_KEY = 'find_alarm calendars'
+
+def discover_calendars(session, temboo_credentials):
+	"""Return the IDs of the calendars in the account's calendar list.  The list is fetched at most
+	once every DISCOVERY_SECONDS, and the last list found is used if it can't be fetched."""
+	stored = fallback.load(DISCOVERY_KEY)
+	if stored is not None and stored.age < DISCOVERY_SECONDS:
+		return stored.response
+	try:
+		choreo = GetAllCalendars(session)
+		inputs = choreo.new_input_set()
+		inputs.set_credential(temboo_credentials)
+		inputs.set_Count('50')
+		response = choreo.execute_with_results(inputs).get_json('Response')
+		calendars = [calendar['id'] for calendar in (response or {}).get('items', [])]
+	except Exception:
+		calendars = []
+	if not calendars:
+		return stored.response if stored is not None else []
+	fallback.save(DISCOVERY_KEY, calendars)
+	return calendars
+
+def calendar_ids(calendar_id, discover=None):
+	"""Return the list of calendar IDs in a calendar_id argument of one or more IDs separated by
+	commas.  ALL_CALENDARS is replaced with the IDs returned by discover(), or with the last
+	discovered IDs when discover is None."""
+	ids = []
+	for id in calendar_id.split(','):
+		id = id.strip()
+		if id == ALL_CALENDARS:
+			if discover is not None:
+				found = discover()
+			else:
+				stored = fallback.load(DISCOVERY_KEY)
+				found = stored.response if stored is not None else []
+			ids.extend(found)
+		elif id:
+			ids.append(id)
+	# Drop duplicates (e.g. a calendar named as well as discovered) but keep the order.
+	seen = set()
+	return [id for id in ids if not (id in seen or seen.add(id))]
+
+def sync_calendar(session, temboo_credentials, calendar_id):
+	"""Bring the calendar's local event store up to date.  The first sync fetches every event of the
+	next few days, later syncs only fetch the events changed (or deleted) since the last one."""
 	choreo = SearchEvents(session)
-	inputs = choreo.new_input_set()
-	inputs.set_credential(temboo_credentials)
-	inputs.set_SingleEvent('1')
-	inputs.set_MinTime(start_utc.strftime('%Y-%m-%dT%H:%M:%S.000Z'))
-	inputs.set_CalendarID(calendar_id)
-	inputs.set_OrderBy('startTime')
-	inputs.set_MaxTime(end.strftime('%Y-%m-%dT%H:%M:%S.000Z'))
-	result = choreo.execute_with_results(inputs)
-	return result.get_Response()
+	def fetch(min_time, max_time, last_modified):
+		inputs = choreo.new_input_set()
+		inputs.set_credential(temboo_credentials)
+		inputs.set_SingleEvent('1')
+		inputs.set_MinTime(eventstore.timestamp(min_time))
+		inputs.set_MaxTime(eventstore.timestamp(max_time))
+		inputs.set_CalendarID(calendar_id)
+		if last_modified is None:
+			return paginate(choreo, inputs, page_size=SYNC_PAGE_SIZE)
+		inputs.set_LastModified(last_modified)
+		inputs.set_ShowDeleted('1')
+		return fetch_changes(inputs)
+	def fetch_changes(inputs):
+		try:
+			for event in paginate(choreo, inputs, page_size=SYNC_PAGE_SIZE, max_pages=SYNC_MAX_PAGES):
+				yield event
+		except TembooPageLimitError:
+			raise eventstore.TooManyChanges()
+	eventstore.EventStore(calendar_id).sync(fetch)
+
+class CalendarSync(object):
+	"""A sync of a calendar's local event store, which runs like a choreo in a ChoreoBatch."""
+	def __init__(self, session, temboo_credentials, calendar_id):
+		self.session = session
+		self.temboo_credentials = temboo_credentials
+		self.calendar_id = calendar_id
+
+	def execute_with_results(self, choreo_inputs=None):
+		sync_calendar(self.session, self.temboo_credentials, self.calendar_id)
+
+def _stored_stream(index, calendar_id, start, end):
+	for event in eventstore.EventStore(calendar_id).upcoming(start, end):
+		yield parse_start(event), index, event
+
+def upcoming_events(calendar_ids, start, end):
+	"""Return an iterator over the stored events of all the calendars which start after the aware
+	datetime start and before end, earliest first.  The calendars' events are merged as they are
+	read, so stopping early skips the rest."""
+	streams = [_stored_stream(index, id, start, end) for index, id in enumerate(calendar_ids)]
+	return (event for when, index, event in heapq.merge(*streams))
+
+def horizon(calendar_ids):
+	"""Return the aware datetime up to which the stores of all the calendars hold every event, or
+	None if any of them hasn't been synced yet."""
+	horizons = [eventstore.EventStore(id).horizon() for id in calendar_ids]
+	if not horizons or None in horizons:
+		return None
+	return min(horizons)
+
+def search_events(start_utc, end_utc, temboo_account, temboo_app, temboo_key, temboo_credentials, calendar_id, max_events=8):
+	"""Sync the local event stores of the calendars in calendar_id (see calendar_ids) with Temboo
+	and return a response with the first max_events events that have a start time.  Start_utc and
+	end_utc values are python dates (in UTC) to limit the search for events.  The calendars are
+	synced at the same time, and a calendar that can't be reached is answered from its store
+	unless none of them can be reached.  Raises ValueError if calendar_id names no calendars."""
+	# The calendars share the session and its pooled connections.
+	session = alarm_session.new_session(temboo_account, temboo_app, temboo_key, reuse_tokens=True)
+	ids = calendar_ids(calendar_id, lambda: discover_calendars(session, temboo_credentials))
+	if not ids:
+		# E.g. ALL_CALENDARS when the calendar list has never been fetched.
+		raise ValueError('No calendars found for {0!r}'.format(calendar_id))
+	results = ChoreoBatch([(CalendarSync(session, temboo_credentials, id), None) for id in ids]).execute()
+	# Answer from the stores unless every calendar failed to sync.
+	if not [result for result in results if result.ok]:
+		results[0].get()
+	utc = dateutil.tz.tzutc()
+	events = upcoming_events(ids, start_utc.replace(tzinfo=utc), end_utc.replace(tzinfo=utc))
+	return {'items': list(itertools.islice(events, max_events))}
 
 def parse_start(event):
 	"""Parse the start datetime from the provided calendar event (parsed from JSON).
@@ -41,28 +159,48 @@ def parse_start(event):
 	return dateutil.parser.parse(start.get('dateTime'))
 
 
-if __name__ == '__main__':
-	# Parse parameters from command line.
-	if len(sys.argv) != 6:
-		# Not enough parameters, quit!
-		sys.exit(1)
-	temboo_account = sys.argv[1]
-	temboo_app = sys.argv[2]
-	temboo_key = sys.argv[3]
-	temboo_credentials = sys.argv[4]
-	calendar_id = sys.argv[5]
+def next_alarm(temboo_account, temboo_app, temboo_key, temboo_credentials, calendar_id, err=sys.stderr):
+	"""Find the earliest event in the next 24 hours that hasn't started yet.  Returns a tuple of the
+	fallback.LastGood search answer (None if there's no answer at all) and the event's start
+	datetime (None if there's no such event)."""
 	# Limit event search to next 24 hours.
 	start = datetime.utcnow()
 	end = start + timedelta(days=1)
-	# Search calendar for events.
-	response = search_events(start, end, temboo_account, temboo_app, temboo_key, temboo_credentials, calendar_id)
-	# Parse events from search response.
-	data = json.loads(response)
-	# Print the start time of the earliest non-all day event.
+	# Search calendar for events, answering from the last good search if the network is down or slow.
+	answer = fallback.fetch('find_alarm ' + calendar_id,
+		lambda: search_events(start, end, temboo_account, temboo_app, temboo_key, temboo_credentials, calendar_id))
+	if answer is None:
+		return None, None
+	if answer.age > 60:
+		err.write('Using calendar search from {0:.0f} seconds ago.\n'.format(answer.age))
+	# Events from the (already parsed) search response.
+	data = answer.response
+	# Find the start time of the earliest non-all day event that hasn't started yet (a stale
+	# search can include events which have already passed).
+	now = datetime.now(dateutil.tz.tzutc())
 	for event in data.get('items', []):
 		start = parse_start(event)
-		if start is not None:
-			# Found an event with a start time.  Return the hour and minute in a binary format
-			# which is easier for the Arduino to parse.
-			print struct.pack('BB', start.hour, start.minute)
-			sys.exit(0)
+		if start is not None and start > now:
+			return answer, start
+	return answer, None
+
+def main(argv, out=sys.stdout, err=sys.stderr):
+	"""Find the next alarm with the command line arguments in argv and write its time to out.
+	The calendar ID argument can list several calendars separated by commas, and ALL_CALENDARS
+	stands for all of the account's calendars.  Returns the exit status for the script."""
+	# Parse parameters from command line.
+	if len(argv) != 6:
+		# Not enough parameters, quit!
+		return 1
+	answer, start = next_alarm(argv[1], argv[2], argv[3], argv[4], argv[5], err)
+	if answer is None:
+		return 1
+	if start is not None:
+		# Found an event with a start time.  Return the hour and minute in a binary format
+		# which is easier for the Arduino to parse.
+		out.write(struct.pack('BB', start.hour, start.minute) + '\n')
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
@@ -0,0 +1,104 @@
+# Smart Alarm Clock
+# Combined calendar alarm and mail lookup, answered in a single binary frame.
+# Copyright 2014 Tony DiCola (tony@tonydicola.com)
+# Released under an MIT license (http://opensource.org/licenses/MIT)
+#
+# Usage:
+#   python poll.py TEMBOO_ACCOUNT TEMBOO_APP TEMBOO_KEY CALENDAR_CREDENTIALS CALENDAR_ID
+#                  GMAIL_CREDENTIALS GMAIL_KEYWORD [DAYS LATEST_HOUR BUFFER_MINS VERSION]
+#
+# Runs the find_alarm.py calendar search and the check_email.py inbox check at the same time and
+# writes one FRAME_FORMAT frame (all values big endian):
+#   status        - STATUS_* bits
+#   alarm hour    - hour (0-23) of the next alarm event, 0 when there is none
+#   alarm minute  - minute of the next alarm event
+#   mail lastseen - time (seconds since epoch) of the latest keyword mail, 0 when there is none
+#   hour          - current local hour (0-23)
+#   minute        - current local minute
+# When the schedule arguments are given the frame is followed by the schedule.py table for them,
+# compiled from the calendar events the search just synced.
+
+from datetime import datetime
+import struct
+import sys
+import threading
+
+import check_email
+import dateutil.tz
+import find_alarm
+import schedule
+
+
+FRAME_FORMAT = '>BBBLBB'
+
+STATUS_ALARM_FOUND = 0x01   # There is an alarm event.
+STATUS_ALARM_FAILED = 0x02  # The calendar couldn't be searched, and no earlier search was stored.
+STATUS_MAIL_FAILED = 0x04   # The inbox couldn't be checked, and no earlier check was stored.
+STATUS_ALARM_STALE = 0x08   # The alarm is from an earlier search, the calendar couldn't be reached.
+STATUS_MAIL_STALE = 0x10    # The mail time is from an earlier check, the inbox couldn't be reached.
+
+# Answers older than this many seconds are reported as stale.
+STALE_SECONDS = 60
+
+
+def run_both(alarm_lookup, mail_lookup):
+	"""Call both lookup functions at the same time and return their results as a tuple.  A
+	lookup that raises an error gives a (None, None) result."""
+	results = [(None, None), (None, None)]
+	def run(index, lookup):
+		try:
+			results[index] = lookup()
+		except Exception:
+			pass
+	thread = threading.Thread(target=run, args=(1, mail_lookup))
+	thread.start()
+	run(0, alarm_lookup)
+	thread.join()
+	return results[0], results[1]
+
+def frame(alarm, mail, now):
+	"""Pack the (answer, start) result of find_alarm.next_alarm, the (answer, lastseen) result of
+	check_email.latest_mail and the current local time into a frame."""
+	status = 0
+	alarm_answer, start = alarm
+	mail_answer, lastseen = mail
+	if alarm_answer is None:
+		status |= STATUS_ALARM_FAILED
+	elif alarm_answer.age > STALE_SECONDS:
+		status |= STATUS_ALARM_STALE
+	if start is not None:
+		status |= STATUS_ALARM_FOUND
+	if mail_answer is None:
+		status |= STATUS_MAIL_FAILED
+	elif mail_answer.age > STALE_SECONDS:
+		status |= STATUS_MAIL_STALE
+	return struct.pack(FRAME_FORMAT, status,
+		start.hour if start is not None else 0, start.minute if start is not None else 0,
+		int(lastseen or 0), now.hour, now.minute)
+
+def main(argv, out=sys.stdout, err=sys.stderr):
+	"""Run both lookups with the command line arguments in argv and write the frame to out.
+	Returns the exit status for the script."""
+	if len(argv) not in (8, 12):
+		# Not enough parameters, quit!
+		return 1
+	try:
+		schedule_args = [int(value) for value in argv[8:12]]
+	except ValueError:
+		return 1
+	temboo_account, temboo_app, temboo_key = argv[1:4]
+	calendar_credentials, calendar_id, gmail_credentials, keyword = argv[4:8]
+	alarm, mail = run_both(
+		lambda: find_alarm.next_alarm(temboo_account, temboo_app, temboo_key, calendar_credentials, calendar_id, err),
+		lambda: check_email.latest_mail(temboo_account, temboo_app, temboo_key, gmail_credentials, keyword, err))
+	now = datetime.now(dateutil.tz.tzlocal())
+	out.write(frame(alarm, mail, now))
+	if schedule_args:
+		days, latest_hour, buffer_mins, known_version = schedule_args
+		entries = schedule.build(calendar_id, days, latest_hour, buffer_mins, now)
+		out.write(schedule.table(entries, now.date(), known_version))
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
@@ -0,0 +1,105 @@
+# Smart Alarm Clock
+# Alarm schedule compiler, turns the next days of calendar events into a table for the sketch.
+# Copyright 2014 Tony DiCola (tony@tonydicola.com)
+# Released under an MIT license (http://opensource.org/licenses/MIT)
+#
+# Usage:
+#   python schedule.py TEMBOO_ACCOUNT TEMBOO_APP TEMBOO_KEY CALENDAR_CREDENTIALS CALENDAR_ID
+#                      DAYS LATEST_HOUR BUFFER_MINS VERSION
+#
+# Syncs the calendar like find_alarm.py, then writes the alarms of the next DAYS days as a
+# HEADER_FORMAT header followed by count ENTRY_FORMAT entries (all values big endian):
+#   version - identifies the table, never 0
+#   count   - number of entries, or UNCHANGED (and no entries) when the table's version is VERSION
+# and for each day with events, earliest first:
+#   day     - days after today (local time) the alarm goes off
+#   hour    - hour (0-23) of the alarm
+#   minute  - minute of the alarm
+#   flags   - ENTRY_* bits
+# Alarms are BUFFER_MINS before the day's first event, and days whose first event starts at or
+# after LATEST_HOUR get a skip entry (at the event's time) instead.  Pass a VERSION of 0 when the
+# sketch has no table.
+
+from datetime import datetime, timedelta
+import struct
+import sys
+import zlib
+
+import dateutil.tz
+import find_alarm
+
+
+HEADER_FORMAT = '>HB'
+ENTRY_FORMAT = '>BBBB'
+
+UNCHANGED = 0xFF
+
+ENTRY_ALARM = 0x01      # Sound the alarm at the entry's time.
+ENTRY_SKIP = 0x02       # The day's first event is too late in the day for an alarm.
+ENTRY_CANCELLED = 0x04  # Set by the sketch when the alarm is cancelled or stopped.
+
+
+def compile_entries(events, now, latest_hour, buffer_mins):
+	"""Turn upcoming calendar events (earliest first) into a list of (day, hour, minute, flags)
+	entries for the days after the aware local datetime now.  Alarms which would already have
+	gone off are left out."""
+	local = dateutil.tz.tzlocal()
+	entries = []
+	days = set()
+	for event in events:
+		start = find_alarm.parse_start(event)
+		if start is None:
+			continue
+		start = start.astimezone(local)
+		# Only the first event of each day sets an alarm.
+		if start.date() in days:
+			continue
+		days.add(start.date())
+		if start.hour >= latest_hour:
+			entries.append(((start.date() - now.date()).days, start.hour, start.minute, ENTRY_SKIP))
+			continue
+		alarm = start - timedelta(minutes=buffer_mins)
+		if alarm > now:
+			entries.append(((alarm.date() - now.date()).days, alarm.hour, alarm.minute, ENTRY_ALARM))
+	return entries
+
+def build(calendar_id, days, latest_hour, buffer_mins, now=None):
+	"""Compile the entries for the next days days from the event stores of the calendars in
+	calendar_id (without syncing them).  Days past the stores' horizon are left out."""
+	if now is None:
+		now = datetime.now(dateutil.tz.tzlocal())
+	ids = find_alarm.calendar_ids(calendar_id)
+	horizon = find_alarm.horizon(ids)
+	if horizon is None:
+		return []
+	end = min(now + timedelta(days=days), horizon)
+	return compile_entries(find_alarm.upcoming_events(ids, now, end), now, latest_hour, buffer_mins)
+
+def table(entries, today, known_version=0):
+	"""Return the table for the entries, or just its header when known_version is its version."""
+	packed = ''.join(struct.pack(ENTRY_FORMAT, *entry) for entry in entries)
+	# The entries' days count from today, so a new day makes a new table.
+	version = (zlib.crc32(today.isoformat() + packed) & 0xFFFF) or 1
+	if version == known_version:
+		return struct.pack(HEADER_FORMAT, version, UNCHANGED)
+	return struct.pack(HEADER_FORMAT, version, len(entries)) + packed
+
+def main(argv, out=sys.stdout, err=sys.stderr):
+	"""Compile the schedule with the command line arguments in argv and write the table to out.
+	Returns the exit status for the script."""
+	if len(argv) != 10:
+		# Not enough parameters, quit!
+		return 1
+	try:
+		days, latest_hour, buffer_mins, known_version = [int(value) for value in argv[6:10]]
+	except ValueError:
+		return 1
+	# Sync the event store, which keeps the stored events when the calendar can't be reached.
+	find_alarm.next_alarm(argv[1], argv[2], argv[3], argv[4], argv[5], err)
+	now = datetime.now(dateutil.tz.tzlocal())
+	out.write(table(build(argv[5], days, latest_hour, buffer_mins, now), now.date(), known_version))
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
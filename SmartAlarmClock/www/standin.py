@@ -0,0 +1,234 @@
+# Smart Alarm Clock
+# Local stand-in for the Temboo server, for offline testing and benchmarking.
+# Copyright 2014 Tony DiCola (tony@tonydicola.com)
+# Released under an MIT license (http://opensource.org/licenses/MIT)
+#
+# Usage:
+#   python standin.py [--port 8080] [--fixtures DIR] [--record]
+#                     [--latency MS] [--jitter MS] [--error-rate P] [--drop-rate P]
+#                     [--no-gzip]
+#
+# Then run find_alarm.py or check_email.py with TEMBOO_STANDIN_PORT set to the port to
+# send their requests to the stand-in instead of Temboo (see standin_options.py).  With
+# --record the stand-in forwards every request to the real Temboo server and saves
+# successful choreo responses as fixtures; without it responses are replayed from the
+# fixtures.
+
+import BaseHTTPServer
+import hashlib
+import httplib
+import json
+import optparse
+import os
+import random
+import SocketServer
+import sys
+import threading
+import time
+import urlparse
+import uuid
+import zlib
+
+from temboo.core.cache import canonical_inputs
+from temboo.core.compression import Decoder
+from temboo.core.compression import compress
+from temboo.core.session import TembooSession
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+CHOREOS_PATH = TembooSession.SESSION_BASE_PATH + '/choreos'
+EXECUTIONS_PATH = TembooSession.SESSION_BASE_PATH + '/choreo-executions'
+
+
+def fixture_files(directory, choreo_path, body):
+	"""Return the fixture file names for a choreo execution, most specific first.  The first
+	matches the exact inputs, the second any inputs to the choreo."""
+	name = choreo_path.strip('/').replace('/', '_')
+	digest = hashlib.sha1(canonical_inputs(body)).hexdigest()[:12]
+	return [os.path.join(directory, '{0}-{1}.json'.format(name, digest)),
+		os.path.join(directory, name + '.json')]
+
+
+class StandinHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	"""Handles the choreo execution endpoints of the Temboo REST API."""
+	protocol_version = 'HTTP/1.1'
+	server_version = 'TembooStandin/1.0'
+	# Buffer writes so headers and body go out together instead of one small packet each.
+	wbufsize = -1
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+	def do_POST(self):
+		body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+		decoder = Decoder(self.headers.get('Content-Encoding'))
+		try:
+			body = decoder.decode(body) + decoder.flush()
+		except zlib.error:
+			self._reply(400, 'Bad compressed request body', 'text/plain')
+			return
+		self._handle('POST', body)
+
+	def do_GET(self):
+		self._handle('GET', None)
+
+	def _handle(self, method, body):
+		server = self.server
+		if server.latency or server.jitter:
+			time.sleep((server.latency + random.uniform(0, server.jitter)) / 1000.0)
+		if random.random() < server.drop_rate:
+			# Hang up without answering, like a dropped connection.
+			self.close_connection = 1
+			return
+		if random.random() < server.error_rate:
+			self._reply(503, 'Service Unavailable', 'text/plain')
+			return
+		if server.record:
+			self._forward(method, body)
+			return
+		url = urlparse.urlparse(self.path)
+		params = dict(urlparse.parse_qsl(url.query))
+		if method == 'POST' and url.path.startswith(CHOREOS_PATH + '/'):
+			self._execute(url.path[len(CHOREOS_PATH):], body, params)
+		elif method == 'GET' and url.path.startswith(EXECUTIONS_PATH + '/'):
+			self._execution(url.path[len(EXECUTIONS_PATH) + 1:], params)
+		else:
+			self._reply(404, {'error': 'Unknown resource {0}'.format(url.path)})
+
+	def _execute(self, choreo_path, body, params):
+		"""Run a choreo by replaying its fixture."""
+		result = self.server.load_fixture(choreo_path, body)
+		if result is None:
+			self._reply(404, {'error': 'No fixture for choreo {0}'.format(choreo_path)})
+			return
+		execution = result.setdefault('execution', {})
+		execution['id'] = uuid.uuid4().hex
+		execution['status'] = 'SUCCESS'
+		execution['starttime'] = execution['endtime'] = int(time.time() * 1000)
+		if params.get('mode') == 'async':
+			execution['status'] = 'RUNNING'
+			self.server.add_execution(execution['id'], result, params.get('store_results') == 'True')
+			self._reply(200, {'id': execution['id']})
+		else:
+			self._reply(200, result)
+
+	def _execution(self, exec_id, params):
+		"""Report the status (and with view=outputs the results) of an asynchronous execution."""
+		result = self.server.get_execution(exec_id)
+		if result is None:
+			self._reply(404, {'error': 'No execution {0}'.format(exec_id)})
+		elif params.get('view') == 'outputs':
+			self._reply(200, result)
+		else:
+			self._reply(200, {'execution': result['execution']})
+
+	def _forward(self, method, body):
+		"""Pass the request on to the real Temboo server and save successful choreo responses."""
+		organization = self.headers.get('x-temboo-domain', '').split('/')[0]
+		headers = dict((name, self.headers[name]) for name in ('Authorization', 'x-temboo-domain', 'Accept', 'Content-Type') if name in self.headers)
+		try:
+			conn = httplib.HTTPSConnection('{0}.temboolive.com'.format(organization), timeout=60)
+			conn.request(method, self.path, body, headers)
+			response = conn.getresponse()
+			data = response.read()
+			conn.close()
+		except Exception, e:
+			self._reply(502, 'Temboo server unreachable: {0}'.format(e), 'text/plain')
+			return
+		url = urlparse.urlparse(self.path)
+		params = dict(urlparse.parse_qsl(url.query))
+		if method == 'POST' and response.status == 200 and url.path.startswith(CHOREOS_PATH + '/') and params.get('mode') != 'async':
+			self.server.save_fixture(url.path[len(CHOREOS_PATH):], body, data)
+		self._reply(response.status, data, response.getheader('Content-Type', 'application/json'))
+
+	def _reply(self, status, data, content_type='application/json'):
+		if not isinstance(data, basestring):
+			data = json.dumps(data)
+		encoding = None
+		if self.server.gzip and len(data) >= 256 and 'gzip' in self.headers.get('Accept-Encoding', ''):
+			data = compress(data)
+			encoding = 'gzip'
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		if encoding:
+			self.send_header('Content-Encoding', encoding)
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+
+class StandinServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	"""Threaded stand-in server holding the fixtures, fault injection settings and the state
+	of asynchronous executions."""
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, address, fixtures=FIXTURES_DIR, record=False, latency=0, jitter=0,
+			error_rate=0.0, drop_rate=0.0, async_seconds=1.0, gzip=True, verbose=False):
+		BaseHTTPServer.HTTPServer.__init__(self, address, StandinHandler)
+		self.fixtures = fixtures
+		self.record = record
+		self.latency = latency
+		self.jitter = jitter
+		self.error_rate = error_rate
+		self.drop_rate = drop_rate
+		self.async_seconds = async_seconds
+		self.gzip = gzip
+		self.verbose = verbose
+		self._executions = {}
+		self._lock = threading.Lock()
+
+	def load_fixture(self, choreo_path, body):
+		for filename in fixture_files(self.fixtures, choreo_path, body):
+			if os.path.exists(filename):
+				with open(filename) as f:
+					return json.load(f)
+		return None
+
+	def save_fixture(self, choreo_path, body, data):
+		if not os.path.isdir(self.fixtures):
+			os.makedirs(self.fixtures)
+		for filename in fixture_files(self.fixtures, choreo_path, body):
+			with open(filename, 'w') as f:
+				f.write(data)
+
+	def add_execution(self, exec_id, result, store_results):
+		with self._lock:
+			self._executions[exec_id] = (time.time() + self.async_seconds, result, store_results)
+
+	def get_execution(self, exec_id):
+		"""Return the result of an asynchronous execution, which stays RUNNING for async_seconds."""
+		with self._lock:
+			entry = self._executions.get(exec_id)
+		if entry is None:
+			return None
+		finished, result, store_results = entry
+		if time.time() < finished:
+			return result
+		result = dict(result, execution=dict(result['execution'], status='SUCCESS'))
+		if not store_results:
+			result['output'] = {}
+		return result
+
+
+if __name__ == '__main__':
+	parser = optparse.OptionParser(usage='%prog [options]')
+	parser.add_option('--port', type='int', default=8080, help='port to listen on (default 8080)')
+	parser.add_option('--fixtures', default=FIXTURES_DIR, help='directory of recorded responses')
+	parser.add_option('--record', action='store_true', help='forward requests to Temboo and record responses')
+	parser.add_option('--latency', type='float', default=0, help='milliseconds added to every response')
+	parser.add_option('--jitter', type='float', default=0, help='up to this many more random milliseconds')
+	parser.add_option('--error-rate', type='float', default=0.0, help='fraction of requests answered with a 503')
+	parser.add_option('--drop-rate', type='float', default=0.0, help='fraction of connections closed without answering')
+	parser.add_option('--no-gzip', action='store_false', dest='gzip', default=True, help='never compress responses')
+	parser.add_option('--verbose', action='store_true', help='log every request')
+	options, args = parser.parse_args()
+	server = StandinServer(('localhost', options.port), options.fixtures, options.record,
+		options.latency, options.jitter, options.error_rate, options.drop_rate, gzip=options.gzip, verbose=options.verbose)
+	sys.stderr.write('Temboo stand-in listening on port {0} ({1} {2}).\n'.format(options.port,
+		'recording to' if options.record else 'replaying from', options.fixtures))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,15 @@
+# Smart Alarm Clock
+# Session options to send Temboo requests to a local stand-in server (see standin.py).
+# Copyright 2014 Tony DiCola (tony@tonydicola.com)
+# Released under an MIT license (http://opensource.org/licenses/MIT)
+
+import os
+
+
+def session_options():
+	"""Return extra TembooSession keyword arguments to connect to a local stand-in server
+	when the TEMBOO_STANDIN_PORT environment variable is set (or no arguments when it isn't)."""
+	port = os.environ.get('TEMBOO_STANDIN_PORT')
+	if not port:
+		return {}
+	return {'base_host': 'localhost', 'port': port, 'secure': False}
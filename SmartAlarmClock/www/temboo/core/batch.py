@@ -0,0 +1,155 @@
+###############################################################################
+#
+# temboo.core.batch.ChoreoBatch
+# temboo.core.batch.BatchResult
+#
+# Runs a set of choreo executions concurrently on a bounded thread pool.
+#
+# Python version 2.6
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+#
+###############################################################################
+
+
+import sys
+import threading
+from Queue import Queue
+
+
+class BatchResult(object):
+    """
+    The outcome of one execution in a ChoreoBatch.
+    """
+
+    def __init__(self, index, choreo, choreo_inputs):
+        self.index = index
+        self.choreo = choreo
+        self.choreo_inputs = choreo_inputs
+        self.result_set = None
+        self.exc_info = None
+
+    @property
+    def ok(self):
+        return self.exc_info is None
+
+    @property
+    def error(self):
+        if self.exc_info:
+            return self.exc_info[1]
+        return None
+
+    def get(self):
+        """
+        Returns the ResultSet, or re-raises the error the execution failed with.
+
+        """
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result_set
+
+
+class ChoreoBatch(object):
+    """
+    Executes several choreos at once so that the total wall time is that
+    of the slowest execution rather than the sum of all of them.
+
+    Choreos created from the same TembooSession (or from sessions for the
+    same host) share that host's connection pool.
+    """
+
+    def __init__(self, items=None, max_workers=4):
+        """Construct a new ChoreoBatch
+
+        items       -- an optional list of (choreo, InputSet) pairs.
+                       The InputSet may be None. (default None)
+        max_workers -- the maximum number of executions that run at
+                       the same time. (default 4)
+
+        """
+        self.max_workers = max(1, int(max_workers))
+        self._items = []
+        for choreo, choreo_inputs in items or []:
+            self.add(choreo, choreo_inputs)
+
+
+    def add(self, choreo, choreo_inputs=None):
+        """Adds an execution to the batch.
+
+        choreo        -- a Choreography instance, or any other object with
+                         an execute_with_results(choreo_inputs) method,
+                         e.g. one that runs several paged executions.
+        choreo_inputs -- an optional InputSet for it. (default None)
+
+        Returns the index of the execution within the batch.
+
+        """
+        self._items.append((choreo, choreo_inputs))
+        return len(self._items) - 1
+
+
+    def __len__(self):
+        return len(self._items)
+
+
+    def execute_as_completed(self):
+        """Runs every execution in the batch.
+
+        Returns a generator yielding a BatchResult for each execution as
+        soon as it finishes. Errors are captured in the BatchResult
+        rather than raised.
+
+        """
+        pending = Queue()
+        done = Queue()
+        for index, (choreo, choreo_inputs) in enumerate(self._items):
+            pending.put(BatchResult(index, choreo, choreo_inputs))
+
+        def worker():
+            while True:
+                item = pending.get()
+                if item is None:
+                    return
+                try:
+                    item.result_set = item.choreo.execute_with_results(item.choreo_inputs)
+                except:
+                    item.exc_info = sys.exc_info()
+                done.put(item)
+
+        count = len(self._items)
+        threads = []
+        for i in range(min(self.max_workers, count)):
+            pending.put(None)
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for i in range(count):
+            yield done.get()
+        for thread in threads:
+            thread.join()
+
+
+    def execute(self):
+        """Runs every execution in the batch and waits for all of them.
+
+        Returns a list of BatchResult instances in the order the
+        executions were added.
+
+        """
+        results = [None] * len(self._items)
+        for item in self.execute_as_completed():
+            results[item.index] = item
+        return results
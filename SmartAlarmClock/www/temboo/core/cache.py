@@ -0,0 +1,257 @@
+###############################################################################
+#
+# temboo.core.cache.ResponseCache
+# temboo.core.cache.MemoryCache
+# temboo.core.cache.FileCache
+#
+# Opt-in TTL caching of choreo execution results.
+#
+# Python version 2.6
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+#
+###############################################################################
+
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from temboo.core.util import save_json
+
+
+# Read-only choreos used by the alarm clock, and how long (in seconds)
+# their results may be reused.
+DEFAULT_TTLS = {
+    '/Library/Google/Calendar/SearchEvents': 60,
+    '/Library/Google/Calendar/GetNextEvent': 60,
+    '/Library/Google/Calendar/GetAllEvents': 60,
+    '/Library/Google/Calendar/GetAllCalendars': 600,
+    '/Library/Google/Calendar/GetAllSettings': 600,
+    '/Library/Google/Gmail/InboxFeed': 60,
+}
+
+
+def canonical_inputs(body):
+    """Returns a canonical form of an InputSet.format_inputs() string.
+
+    The input list is sorted by name and the JSON re-encoded with sorted
+    keys, so two InputSets with the same values always give the same
+    string regardless of the order the inputs were set in.
+
+    """
+    data = json.loads(body) if body else {}
+    if 'inputs' in data:
+        data['inputs'] = sorted(data['inputs'], key=lambda i: i.get('name'))
+    return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+
+class MemoryCache(object):
+    """
+    A size-bounded, least recently used in-memory cache backend.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = int(max_entries)
+        self._lock = threading.Lock()
+        self.clear()
+
+    def _unlink(self, link):
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+        del self._entries[link[2]]
+
+    def get(self, key):
+        """
+        Returns the value stored under key, or None if missing or expired.
+
+        """
+        self._lock.acquire()
+        try:
+            link = self._entries.get(key)
+            if link is None:
+                return None
+            if link[3] <= time.time():
+                self._unlink(link)
+                return None
+            #Move the entry to the most recently used end.
+            prev, next = link[0], link[1]
+            prev[1] = next
+            next[0] = prev
+            root = self._root
+            last = root[0]
+            last[1] = root[0] = link
+            link[0] = last
+            link[1] = root
+            return link[4]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, ttl):
+        self._lock.acquire()
+        try:
+            if key in self._entries:
+                self._unlink(self._entries[key])
+            root = self._root
+            while self._entries and len(self._entries) >= self.max_entries:
+                self._unlink(root[1])
+            last = root[0]
+            link = [last, root, key, time.time() + ttl, value]
+            last[1] = root[0] = self._entries[key] = link
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries = {}
+            #Circular list of [prev, next, key, expires, value] links, most
+            #recently used last (collections.OrderedDict needs Python 2.7).
+            self._root = []
+            self._root[:] = [self._root, self._root, None, None, None]
+        finally:
+            self._lock.release()
+
+
+class FileCache(object):
+    """
+    A size-bounded on-disk cache backend, so that cached results survive
+    from one process to the next. Each entry is a JSON file named after
+    its key; a file's modification time records when it was last used.
+    """
+
+    def __init__(self, directory=None, max_entries=64):
+        """Construct a new FileCache
+
+        directory   -- where to keep cache files.
+                       (default: temboo-cache in the temp directory)
+        max_entries -- the number of entries kept before the least
+                       recently used ones are deleted. (default 64)
+
+        """
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), 'temboo-cache')
+        self.directory = directory
+        self.max_entries = int(max_entries)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _file(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        filename = self._file(key)
+        try:
+            with open(filename) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get('expires', 0) <= time.time():
+            return None
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return entry.get('value')
+
+    def set(self, key, value, ttl):
+        save_json(self._file(key), {'expires': time.time() + ttl, 'value': value})
+        self._evict()
+
+    def _evict(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                filename = os.path.join(self.directory, name)
+                try:
+                    files.append((os.path.getmtime(filename), filename))
+                except OSError:
+                    pass
+        if len(files) <= self.max_entries:
+            return
+        files.sort()
+        for mtime, filename in files[:len(files) - self.max_entries]:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+class ResponseCache(object):
+    """
+    Caches successful choreo execution results keyed on the account, the
+    choreo path and its canonicalized inputs. Only choreos with a TTL are
+    cached, so choreos that change data are never served from the cache.
+    """
+
+    def __init__(self, backend=None, ttls=None, default_ttl=0):
+        """Construct a new ResponseCache
+
+        backend     -- a MemoryCache, FileCache or any object with the same
+                       get/set methods. (default: a new MemoryCache)
+        ttls        -- a dict of choreo path to the number of seconds its
+                       results may be reused. (default DEFAULT_TTLS)
+        default_ttl -- the TTL for choreos not listed in ttls. 0 disables
+                       caching for them. (default 0)
+
+        """
+        self.backend = backend if backend is not None else MemoryCache()
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+
+    def ttl(self, path):
+        return self.ttls.get(path, self.default_ttl)
+
+    def key(self, path, body, scope=''):
+        """Returns the cache key for a choreo execution.
+
+        path  -- the choreo path.
+        body  -- the format_inputs() body.
+        scope -- identifies the account and application the execution
+                 runs as, so that sessions sharing a backend (e.g. the
+                 default FileCache directory) but not credentials never
+                 see each other's results. (default '')
+
+        """
+        return hashlib.sha1(scope + '\n' + path + '\n' + canonical_inputs(body)).hexdigest()
+
+    def get(self, path, body, scope=''):
+        """
+        Returns a cached execution result, or None.
+
+        """
+        if self.ttl(path) <= 0:
+            return None
+        return self.backend.get(self.key(path, body, scope))
+
+    def set(self, path, body, result, scope=''):
+        """
+        Stores an execution result if its choreo is cacheable.
+
+        """
+        ttl = self.ttl(path)
+        if ttl > 0:
+            self.backend.set(self.key(path, body, scope), result, ttl)
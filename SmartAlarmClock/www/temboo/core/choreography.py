@@ -25,14 +25,28 @@
 #
 ###############################################################################
 
+import copy
 import datetime
+import hashlib
 import json
 import pprint
+import time
 
+from temboo.core.cache import canonical_inputs
+from temboo.core.exception import TembooHTTPError
 from temboo.core.resource import _TembooResource
+from temboo.core.retry import READ_ONLY_CHOREOS
+from temboo.core.singleflight import SingleFlight
+from temboo.core.tokencache import is_unauthorized
 from temboo.core.util import ExecutionStatus
+from temboo.core.util import PollPolicy
 from temboo.core.session import TembooSession
 
+
+#Executions of read-only choreos that are currently in progress, so that
+#identical concurrent executions can share one request.
+_in_flight = SingleFlight()
+
 class Choreography(_TembooResource):
 
 
@@ -53,23 +67,144 @@ class Choreography(_TembooResource):
         _TembooResource.__init__(self, temboo_session, temboo_path)
 
 
-    def execute_with_results(self, choreo_inputs=None):
+    def execute_with_results(self, choreo_inputs=None, lazy=False):
         """Runs the choreography and waits for it to complete.
         
         This method will run this choreography with the supplied
         inputs, block while waiting for it to complete,
         and return the results as a dict with keys of
         'output' and 'execution'.
+
+        If the session has a ResponseCache, a fresh cached result for
+        the same choreo and inputs is returned without contacting the
+        server, and successful results are added to the cache.
+
+        Concurrent executions of the same read-only choreo (see
+        temboo.core.retry.READ_ONLY_CHOREOS) with the same inputs, for
+        the same account, share a single request and its results.
+
+        If the session has a TokenCache, OAuth access tokens returned by
+        earlier executions are passed on as the AccessToken input (see
+        TokenCache).
         
         choreo_inputs -- an optional instance of InputSet (default = None)
 
+        lazy -- True to keep the raw server response and only decode it
+                when the results are first accessed. (default = False)
+
         Returns a ResultSet instance.
 
         """
         choreo_inputs = choreo_inputs if choreo_inputs else InputSet()
         body = choreo_inputs.format_inputs();
         params = {"source_id": TembooSession.SOURCE_ID}
-        return self._make_result_set(self._temboo_session.post(self.get_session_path(), body, params), self._temboo_path)
+        session = self._temboo_session
+        cache = getattr(session, 'cache', None)
+        if cache is not None:
+            #Results are only shared by sessions with the same host, account,
+            #app key name and app key (which is in the Authorization header).
+            authorization = getattr(session, '_headers', {}).get('Authorization', '')
+            scope = '{0} {1} {2}'.format(getattr(session, '_host', ''), getattr(session, '_account', ''),
+                                         hashlib.sha1(authorization).hexdigest())
+            #A cache hit skips the server entirely.
+            result = cache.get(self._temboo_path, body, scope)
+            if result is not None:
+                return self._make_result_set(result, self._temboo_path)
+
+        def execute():
+            result_set = self._post_with_token(choreo_inputs, body, params, lazy)
+            if cache is not None and result_set.status == ExecutionStatus.SUCCESS:
+                cache.set(self._temboo_path, body, result_set._result, scope)
+            return result_set
+
+        if self._temboo_path not in READ_ONLY_CHOREOS:
+            return execute()
+        key = (getattr(session, '_host', None), tuple(sorted(session._headers.items())),
+               self._temboo_path, canonical_inputs(body))
+        #Each caller gets its own copy of the shared ResultSet, since
+        #result sets memoize the outputs they parse.
+        return self._make_result_set(_in_flight.do(key, execute), self._temboo_path)
+
+    def _post_with_token(self, choreo_inputs, body, params, lazy):
+        """
+        Executes the choreo with a cached OAuth access token if there is
+        one, and caches any new token it returns.
+
+        """
+        session = self._temboo_session
+        tokens = getattr(session, 'token_cache', None)
+        key = tokens.key(getattr(session, '_account', None), choreo_inputs) if tokens is not None else None
+        def post(body):
+            result = session.post(self.get_session_path(), body, params, decode=not lazy)
+            return self._make_result_set(result, self._temboo_path)
+        if key is None:
+            return post(body)
+
+        token = tokens.get(key)
+        if token is None:
+            result_set = post(body)
+        else:
+            inputs = copy.copy(choreo_inputs)
+            inputs.inputs = dict(choreo_inputs.inputs)
+            inputs.set_AccessToken(token)
+            try:
+                result_set = post(inputs.format_inputs())
+                refused = (result_set.status != ExecutionStatus.SUCCESS and
+                           is_unauthorized(result_set.last_error))
+            except TembooHTTPError, e:
+                if not is_unauthorized(e.args[3]):
+                    raise
+                refused = True
+            if refused:
+                #Run again without the token, so Temboo refreshes it.
+                tokens.discard(key, token)
+                result_set = post(body)
+        if result_set.status == ExecutionStatus.SUCCESS:
+            new_token = result_set._output.get('NewAccessToken')
+            if new_token:
+                tokens.set(key, new_token)
+        return result_set
+
+    def execute_stream(self, choreo_inputs=None, chunk_size=8192):
+        """Runs the choreography and streams back the raw results.
+
+        This method runs this choreography with the supplied inputs
+        and returns the execution response as it arrives, so that
+        large results can be parsed incrementally (see
+        temboo.core.jsonstream) without holding the whole response in
+        memory. The response cache is not used.
+
+        choreo_inputs -- an optional instance of InputSet (default = None)
+
+        chunk_size -- the largest number of bytes read from the
+                      server at a time. (default = 8192)
+
+        Returns a generator of string chunks of the JSON response.
+
+        """
+        choreo_inputs = choreo_inputs if choreo_inputs else InputSet()
+        body = choreo_inputs.format_inputs();
+        params = {"source_id": TembooSession.SOURCE_ID}
+        return self._temboo_session.post_stream(self.get_session_path(), body, params, chunk_size)
+
+    def execute_with_results_async(self, choreo_inputs=None):
+        """Runs the choreography without blocking the calling thread.
+
+        This method starts this choreography with the supplied inputs
+        on the session's event loop and returns immediately. The
+        session must be an AsyncTembooSession.
+
+        choreo_inputs -- an optional instance of InputSet (default = None)
+
+        Returns a Future whose result is a ResultSet instance. Calling
+        result() on it runs the event loop until the choreo completes.
+
+        """
+        choreo_inputs = choreo_inputs if choreo_inputs else InputSet()
+        body = choreo_inputs.format_inputs();
+        params = {"source_id": TembooSession.SOURCE_ID}
+        future = self._temboo_session.post_async(self.get_session_path(), body, params)
+        return future.then(lambda result: self._make_result_set(result, self._temboo_path))
 
     def _make_result_set(self, result, path):
         return ResultSet(result, path)
@@ -162,7 +297,9 @@ class ResultSet(object):
         from a choreo execution.
 
         result -- may be either a dictionary containing choreo execution
-                  results or another ResultSet instance. Giving another
+                  results, the undecoded JSON string of such a dictionary
+                  (which is then decoded on first use), or another
+                  ResultSet instance. Giving another
                   ResultSet instance is useful for converting a generic
                   ResultSet returned by ChoreographyExecution.get_results
                   into a choreo-specific result set.
@@ -172,14 +309,52 @@ class ResultSet(object):
         
         """
         if isinstance(result, ResultSet):
-            self._result = result._result
+            self._raw = result._raw
+            self._decoded = result._decoded
             self._path = result._path
+        elif isinstance(result, basestring):
+            self._raw = result
+            self._decoded = None
+            self._path = path
         else:
-            self._result = result
+            self._raw = None
+            self._decoded = result
             self._path = path
 
-        self._exec_data = self._result.get("execution", {})
-        self._output = self._result.get("output", {})
+        self._parsed = {}
+
+    @property
+    def _result(self):
+        #Raw results are only decoded the first time they are needed.
+        if self._decoded is None:
+            self._decoded = json.loads(self._raw)
+            self._raw = None
+        return self._decoded
+
+    @property
+    def _exec_data(self):
+        return self._result.get("execution", {})
+
+    @property
+    def _output(self):
+        return self._result.get("output", {})
+
+    def get_json(self, name):
+        """Returns the named output decoded from JSON.
+
+        Outputs such as "Response" are JSON documents carried as
+        strings. The decoded value is kept, so calling this again
+        (or from another accessor) does not parse the output twice.
+
+        name -- the name of the output.
+
+        Returns the decoded value, or None if there is no such output.
+
+        """
+        if name not in self._parsed:
+            value = self._output.get(name, None)
+            self._parsed[name] = json.loads(value) if value is not None else None
+        return self._parsed[name]
 
     @property
     def path(self):
@@ -296,6 +471,47 @@ class ChoreographyExecution(_TembooResource):
 
         return self._result_set
 
+    def wait(self, timeout=None, poll_policy=None):
+        """Waits for the execution to finish.
+
+        The server is polled with exponential backoff rather than in
+        a tight loop, to save requests against the account quota.
+
+        timeout     -- the maximum number of seconds to wait, or None
+                       to wait indefinitely. (default None)
+        poll_policy -- a PollPolicy controlling the intervals between
+                       polls. (default PollPolicy())
+
+        Returns True if the execution finished, or False if it was
+        still running when the timeout expired.
+
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        delays = (poll_policy or PollPolicy()).delays()
+        while self.status == ExecutionStatus.RUNNING:
+            delay = delays.next()
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                delay = min(delay, remaining)
+            time.sleep(delay)
+        return True
+
+    def get_result_set(self, timeout=None, poll_policy=None):
+        """Waits for the execution to finish and returns its results.
+
+        Takes the same arguments as wait.
+
+        Returns a ResultSet, or None if the execution was still running
+        when the timeout expired. The execution must have been started
+        with store_results=True for the results to be available.
+
+        """
+        if not self.wait(timeout, poll_policy):
+            return None
+        return self.result_set
+
     def _make_result_set(self, response, path):
         return ResultSet(response, path)
 
@@ -306,3 +522,42 @@ class ChoreographyExecution(_TembooResource):
         msg.append("Execution ID: " + str(self.exec_id))
         msg.append("Status: " + str(self.status))
         return "\n".join(msg)
+
+
+def as_completed(executions, timeout=None, poll_policy=None):
+    """Waits for several ChoreographyExecutions at once.
+
+    All unfinished executions are polled together each round, with the
+    rounds spaced out according to poll_policy.
+
+    executions  -- an iterable of ChoreographyExecution instances.
+    timeout     -- the maximum number of seconds to wait, or None to
+                   wait indefinitely. (default None)
+    poll_policy -- a PollPolicy controlling the intervals between
+                   rounds. (default PollPolicy())
+
+    Returns a generator yielding each execution as it finishes. The
+    generator stops early, without yielding the executions that are
+    still running, once the timeout expires.
+
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    delays = (poll_policy or PollPolicy()).delays()
+    pending = list(executions)
+    while pending:
+        running = []
+        for execution in pending:
+            if execution.status == ExecutionStatus.RUNNING:
+                running.append(execution)
+            else:
+                yield execution
+        pending = running
+        if not pending:
+            return
+        delay = delays.next()
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            delay = min(delay, remaining)
+        time.sleep(delay)
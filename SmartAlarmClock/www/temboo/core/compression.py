@@ -0,0 +1,150 @@
+###############################################################################
+#
+# temboo.core.compression.compress
+# temboo.core.compression.Decoder
+# temboo.core.compression.CompressionStats
+#
+# gzip/deflate content coding of Temboo request and response bodies.
+#
+# Python version 2.6
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+#
+###############################################################################
+
+
+import threading
+import zlib
+
+
+# The Accept-Encoding header value sent with every compressed session request.
+ACCEPT_ENCODING = 'gzip, deflate'
+
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def compress(body, level=6):
+    """
+    Returns body gzip compressed, for sending with Content-Encoding: gzip.
+
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _GZIP_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+class Decoder(object):
+    """
+    Incrementally decodes a response body sent with a Content-Encoding.
+    """
+
+    def __init__(self, encoding):
+        """Construct a new Decoder
+
+        encoding -- the response's Content-Encoding header value. Bodies
+                    with no (or an unknown) coding pass through unchanged.
+
+        """
+        encoding = (encoding or '').strip().lower()
+        self.encoding = encoding if encoding in ('gzip', 'x-gzip', 'deflate') else None
+        self._raw_deflate = False
+        self._decompressor = None
+        if self.encoding == 'deflate':
+            self._decompressor = zlib.decompressobj()
+        elif self.encoding:
+            self._decompressor = zlib.decompressobj(_GZIP_WBITS)
+
+    def decode(self, data):
+        """
+        Returns the decoded bytes available after adding data.
+
+        """
+        if self._decompressor is None or not data:
+            return data
+        try:
+            return self._decompressor.decompress(data)
+        except zlib.error:
+            #Some servers send "deflate" bodies without the zlib header
+            #that the HTTP spec calls for. Start over as raw deflate.
+            if self.encoding != 'deflate' or self._raw_deflate:
+                raise
+            self._raw_deflate = True
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._decompressor.decompress(data)
+
+    def flush(self):
+        """
+        Returns any decoded bytes still held back at the end of the body.
+
+        """
+        if self._decompressor is None:
+            return ''
+        return self._decompressor.flush()
+
+
+class CompressionStats(object):
+    """
+    Counts the bytes a TembooSession sends and receives, before and after
+    content coding, to show what compression saves.
+
+    Sizes only cover message bodies, not headers.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.requests_compressed = 0
+        self.request_bytes = 0
+        self.request_wire_bytes = 0
+        self.responses = 0
+        self.responses_compressed = 0
+        self.response_bytes = 0
+        self.response_wire_bytes = 0
+        self._lock = threading.Lock()
+
+    def add_request(self, size, wire_size):
+        self._lock.acquire()
+        try:
+            self.requests += 1
+            if wire_size != size:
+                self.requests_compressed += 1
+            self.request_bytes += size
+            self.request_wire_bytes += wire_size
+        finally:
+            self._lock.release()
+
+    def add_response(self, size, wire_size, compressed):
+        self._lock.acquire()
+        try:
+            self.responses += 1
+            if compressed:
+                self.responses_compressed += 1
+            self.response_bytes += size
+            self.response_wire_bytes += wire_size
+        finally:
+            self._lock.release()
+
+    @property
+    def bytes_saved(self):
+        """
+        Bytes that did not have to be transferred thanks to compression.
+
+        """
+        return (self.request_bytes - self.request_wire_bytes +
+                self.response_bytes - self.response_wire_bytes)
+
+    def __repr__(self):
+        return ('<CompressionStats sent {0}/{1} bytes ({2} compressed), '
+                'received {3}/{4} bytes ({5} compressed), saved {6} bytes>').format(
+            self.request_wire_bytes, self.request_bytes, self.requests_compressed,
+            self.response_wire_bytes, self.response_bytes, self.responses_compressed,
+            self.bytes_saved)
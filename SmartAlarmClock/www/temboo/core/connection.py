@@ -0,0 +1,282 @@
+###############################################################################
+#
+# temboo.core.connection.ConnectionPool
+# temboo.core.connection.HTTPConnection
+# temboo.core.connection.HTTPSConnection
+# temboo.core.connection.get_pool
+# temboo.core.connection.default_ssl_context
+#
+# Keep-alive HTTP/S connection pooling for TembooSession.
+#
+# Python version 2.6
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+#
+###############################################################################
+
+
+import httplib
+import select
+import socket
+import ssl
+import threading
+import time
+
+from temboo.core import metrics
+
+
+_default_context = None
+_default_context_lock = threading.Lock()
+
+def default_ssl_context():
+    """Returns the SSL context shared by all https connections.
+
+    The context verifies the server certificate against the system's CA
+    certificates. Loading them is slow, so it is only done once, when the
+    context is first needed.
+
+    Returns None if this ssl module has no SSLContext (Python < 2.7.9).
+
+    """
+    global _default_context
+    if not hasattr(ssl, 'create_default_context'):
+        return None
+    _default_context_lock.acquire()
+    try:
+        if _default_context is None:
+            _default_context = ssl.create_default_context()
+        return _default_context
+    finally:
+        _default_context_lock.release()
+
+
+class HTTPConnection(httplib.HTTPConnection):
+    """
+    An httplib.HTTPConnection that records how long connecting took.
+
+    After connect(), timings holds a list of (phase, seconds) tuples.
+    """
+
+    timings = ()
+
+    def connect(self):
+        start = time.time()
+        httplib.HTTPConnection.connect(self)
+        self.timings = [(metrics.CONNECT, time.time() - start)]
+
+
+class HTTPSConnection(httplib.HTTPSConnection):
+    """
+    An httplib.HTTPSConnection that records the TCP connect and the TLS
+    handshake separately.
+
+    After connect(), timings holds a list of (phase, seconds) tuples.
+    Python 2's ssl module can't resume TLS sessions, so every new
+    connection makes a full handshake; keeping connections alive in a
+    ConnectionPool is what saves them.
+    """
+
+    timings = ()
+
+    def __init__(self, host, timeout=None, context=None):
+        if context is not None:
+            httplib.HTTPSConnection.__init__(self, host, timeout=timeout, context=context)
+        else:
+            httplib.HTTPSConnection.__init__(self, host, timeout=timeout)
+
+    def connect(self):
+        start = time.time()
+        args = [(self.host, self.port), self.timeout]
+        if getattr(self, 'source_address', None):
+            args.append(self.source_address)
+        sock = socket.create_connection(*args)
+        connected = time.time()
+        if getattr(self, '_tunnel_host', None):
+            self.sock = sock
+            self._tunnel()
+        context = getattr(self, '_context', None)
+        if context is not None:
+            server_hostname = getattr(self, '_tunnel_host', None) or self.host
+            self.sock = context.wrap_socket(sock, server_hostname=server_hostname)
+        else:
+            self.sock = ssl.wrap_socket(sock, self.key_file, self.cert_file)
+        self.timings = [(metrics.CONNECT, connected - start),
+                        (metrics.TLS, time.time() - connected)]
+
+
+class ConnectionPool(object):
+    """
+    Keeps a set of persistent HTTP/1.1 connections to a single host so
+    that consecutive requests can skip the TCP and TLS handshakes.
+    """
+
+    def __init__(self, host, secure=True, max_size=4, idle_timeout=60.0, timeout=None, ssl_context=None):
+        """Construct a new ConnectionPool
+
+        host         -- a 'hostname:port' string to connect to.
+
+        Keyword arguments
+        secure       -- True = use secure (https) connections (default)
+                        False = use unsecure (http) connections.
+        max_size     -- maximum number of idle connections kept open
+                        for reuse.  Connections released while the pool
+                        is full are closed. (default 4)
+        idle_timeout -- seconds an idle connection may sit in the pool
+                        before it is discarded instead of reused. Servers
+                        drop idle keep-alive sockets on their own, so this
+                        should stay below the server's limit. (default 60)
+        timeout      -- socket timeout in seconds for new connections,
+                        or None to block indefinitely. Requests made
+                        with a deadline (see RetryPolicy) use that
+                        instead. (default None)
+        ssl_context  -- the ssl.SSLContext for secure connections.
+                        (default: default_ssl_context())
+
+        """
+        self.host = host
+        self.secure = bool(secure)
+        self.max_size = int(max_size)
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ssl_context = ssl_context if ssl_context is not None else default_ssl_context()
+        self._idle = []
+        self._lock = threading.Lock()
+
+
+    def _new_connection(self):
+        """
+        Create a new (not yet connected) connection to the pool's host.
+
+        """
+        if self.secure:
+            return HTTPSConnection(self.host, timeout=self.timeout, context=self.ssl_context)
+        return HTTPConnection(self.host, timeout=self.timeout)
+
+
+    def _is_dropped(self, conn):
+        """
+        Returns True if an idle connection can no longer be used.
+
+        An idle keep-alive socket should never be readable; if it is, the
+        server has either closed it or sent something we didn't ask for.
+
+        """
+        sock = conn.sock
+        if sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return True
+        return bool(readable)
+
+
+    def acquire(self, fresh=False):
+        """Takes a connection out of the pool.
+
+        Idle connections that have expired or been dropped by the server
+        are closed and skipped. If no idle connection is usable a new one
+        is created.
+
+        fresh -- True to always create a new connection, e.g. to resend
+                 a request that failed on a connection the server had
+                 closed. (default False)
+
+        Returns a (connection, reused) tuple, where reused is True if the
+        connection has already carried at least one request.
+
+        """
+        if fresh:
+            return self._new_connection(), False
+        now = time.time()
+        while True:
+            self._lock.acquire()
+            try:
+                if not self._idle:
+                    break
+                conn, last_used = self._idle.pop()
+            finally:
+                self._lock.release()
+            if now - last_used > self.idle_timeout or self._is_dropped(conn):
+                conn.close()
+                continue
+            return conn, True
+        return self._new_connection(), False
+
+
+    def release(self, conn, reusable=True):
+        """Returns a connection to the pool.
+
+        conn     -- a connection previously returned by acquire(). Any
+                    response on it must have been read completely.
+        reusable -- False if the connection must not be reused, e.g.
+                    because the request failed or the server asked to
+                    close it. (default True)
+
+        """
+        if reusable and conn.sock is not None:
+            self._lock.acquire()
+            try:
+                if len(self._idle) < self.max_size:
+                    self._idle.append((conn, time.time()))
+                    return
+            finally:
+                self._lock.release()
+        conn.close()
+
+
+    def clear(self):
+        """
+        Closes all idle connections.
+
+        """
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, []
+        finally:
+            self._lock.release()
+        for conn, last_used in idle:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(host, secure=True, ssl_context=None, **kwargs):
+    """Returns the shared ConnectionPool for a host, creating it if needed.
+
+    Every TembooSession talking to the same host shares one pool, so
+    connections survive from one session object to the next.
+
+    host        -- a 'hostname:port' string.
+    secure      -- True for https, False for http. (default True)
+    ssl_context -- the ssl.SSLContext for https connections. Sessions
+                   with different contexts get different pools.
+                   (default: default_ssl_context())
+
+    Any other keyword arguments (max_size, idle_timeout, timeout) are
+    passed to the ConnectionPool constructor. Callers asking for other
+    settings get another pool, rather than one set up differently.
+
+    """
+    key = (host, bool(secure), ssl_context, tuple(sorted(kwargs.items())))
+    _pools_lock.acquire()
+    try:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(host, secure, ssl_context=ssl_context, **kwargs)
+            _pools[key] = pool
+        return pool
+    finally:
+        _pools_lock.release()
@@ -0,0 +1,371 @@
+###############################################################################
+#
+# temboo.core.eventloop.EventLoop
+# temboo.core.eventloop.Future
+#
+# A select() based event loop for running many HTTP/S requests on
+# non-blocking sockets from a single thread.
+#
+# Python version 2.6
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+#
+###############################################################################
+
+
+import errno
+import httplib
+import select
+import socket
+import ssl
+import sys
+import time
+from StringIO import StringIO
+
+from temboo.core.connection import default_ssl_context
+
+
+class Future(object):
+    """
+    The eventual result of an operation running on an EventLoop.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        """Marks the future as failed.
+
+        exc_info -- a (type, value, traceback) tuple as returned by
+                    sys.exc_info(), so result() can re-raise it with
+                    the original traceback.
+
+        """
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        """
+        Calls callback(future) once the future is done.
+
+        """
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def exception(self):
+        """
+        Returns the exception the operation failed with, or None.
+
+        """
+        self._wait()
+        if self._exc_info:
+            return self._exc_info[1]
+        return None
+
+    def result(self):
+        """Returns the result of the operation.
+
+        If the operation has not finished yet, the event loop is run
+        until it has. If the operation failed, its exception is raised.
+
+        """
+        self._wait()
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def _wait(self):
+        if not self._done:
+            self._loop.run_until_complete([self])
+
+    def then(self, func):
+        """Returns a new Future holding func(result) once this one is done.
+
+        Exceptions from this future (or raised by func) are passed on
+        to the new future.
+
+        """
+        chained = Future(self._loop)
+        def callback(future):
+            if future._exc_info:
+                chained.set_exception(future._exc_info)
+                return
+            try:
+                chained.set_result(func(future._result))
+            except:
+                chained.set_exception(sys.exc_info())
+        self.add_done_callback(callback)
+        return chained
+
+
+class _HTTPRequest(object):
+    """
+    A single HTTP/S request driven by an EventLoop.
+
+    The request is sent with 'Connection: close' and the response is read
+    until the server closes the socket, then parsed with httplib. This
+    keeps the state machine small: connect, (TLS handshake), send, receive.
+    """
+
+    def __init__(self, future, host, port, secure, data, timeout, context=None):
+        self.future = future
+        self.host = host
+        self.port = port
+        self.secure = secure
+        self.context = context if context is not None else default_ssl_context()
+        self.deadline = time.time() + timeout if timeout else None
+        self._out = data
+        self._in = []
+        self.sock = None
+        self.state = None
+
+    def start(self):
+        # Name resolution is blocking; everything after it is not.
+        family, socktype, proto, _, addr = socket.getaddrinfo(
+            self.host, self.port, 0, socket.SOCK_STREAM)[0]
+        self.sock = socket.socket(family, socktype, proto)
+        self.sock.setblocking(0)
+        err = self.sock.connect_ex(addr)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            raise socket.error(err, errno.errorcode.get(err, 'connect failed'))
+        self.state = 'connect'
+        self.want_write = True
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def on_ready(self):
+        """
+        Advances the request. Returns True once the response is complete.
+
+        """
+        if self.state == 'connect':
+            err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                raise socket.error(err, errno.errorcode.get(err, 'connect failed'))
+            if self.secure:
+                if self.context is not None:
+                    self.sock = self.context.wrap_socket(self.sock, server_hostname=self.host,
+                                                    do_handshake_on_connect=False)
+                else:
+                    self.sock = ssl.wrap_socket(self.sock, do_handshake_on_connect=False)
+                self.state = 'handshake'
+            else:
+                self.state = 'send'
+        if self.state == 'handshake':
+            if not self._ssl_step(self.sock.do_handshake):
+                return False
+            self.state = 'send'
+        if self.state == 'send':
+            #Each step waits to write unless _ssl_step finds that OpenSSL
+            #has to read first (e.g. during renegotiation).
+            self.want_write = True
+            sent = self._ssl_step(lambda: self.sock.send(self._out))
+            if sent is None:
+                return False
+            self._out = self._out[sent:]
+            if self._out:
+                return False
+            self.state = 'recv'
+        if self.state == 'recv':
+            while True:
+                self.want_write = False
+                try:
+                    chunk = self._ssl_step(lambda: self.sock.recv(65536))
+                except ssl.SSLError, e:
+                    #Servers often close without a TLS close_notify, which
+                    #OpenSSL reports as an error. httplib still notices a
+                    #response that was cut short.
+                    if e.args[0] != ssl.SSL_ERROR_EOF and 'EOF' not in str(e).upper():
+                        raise
+                    chunk = ''
+                if chunk is None:
+                    return False
+                if not chunk:
+                    return True
+                self._in.append(chunk)
+        return False
+
+    def _ssl_step(self, func):
+        """
+        Runs func, translating 'would block' errors into a None result.
+
+        """
+        try:
+            result = func()
+            return True if result is None else result
+        except ssl.SSLError, e:
+            if e.args[0] == ssl.SSL_ERROR_WANT_READ:
+                self.want_write = False
+                return None
+            if e.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                self.want_write = True
+                return None
+            raise
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return None
+            raise
+
+    def response(self):
+        """
+        Parses the received bytes into an httplib response.
+
+        """
+        response = httplib.HTTPResponse(_BufferSocket(''.join(self._in)))
+        response.begin()
+        return response
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+
+
+class _BufferSocket(object):
+    """
+    Just enough of a socket for httplib.HTTPResponse to parse a buffer.
+    """
+
+    def __init__(self, data):
+        self._data = data
+
+    def makefile(self, *args, **kwargs):
+        return StringIO(self._data)
+
+
+class EventLoop(object):
+    """
+    Multiplexes many in-flight HTTP/S requests over select().
+    """
+
+    def __init__(self):
+        self._requests = []
+
+    def http_request(self, host, port, secure, data, timeout=None, context=None):
+        """Starts sending a raw HTTP request.
+
+        host    -- the host name to connect to.
+        port    -- the port number to connect to.
+        secure  -- True to wrap the connection in TLS.
+        data    -- the complete request (request line, headers and body).
+                   It should ask the server to close the connection.
+        timeout -- seconds before the request fails with socket.timeout,
+                   or None for no limit. (default None)
+        context -- the ssl.SSLContext for secure requests.
+                   (default: the shared default_ssl_context())
+
+        Returns a Future whose result is a fully-read
+        httplib.HTTPResponse.
+
+        """
+        future = Future(self)
+        request = _HTTPRequest(future, host, port, secure, data, timeout, context)
+        try:
+            request.start()
+        except:
+            request.close()
+            future.set_exception(sys.exc_info())
+            return future
+        self._requests.append(request)
+        return future
+
+    def pending(self):
+        """
+        Returns the number of requests still in flight.
+
+        """
+        return len(self._requests)
+
+    def run_once(self, timeout=None):
+        """Waits for socket activity and advances any ready requests.
+
+        timeout -- the maximum number of seconds to wait, or None to
+                   wait until a socket becomes ready. (default None)
+
+        """
+        if not self._requests:
+            return
+        now = time.time()
+        deadlines = [r.deadline for r in self._requests if r.deadline is not None]
+        if deadlines:
+            wait = max(0, min(deadlines) - now)
+            timeout = wait if timeout is None else min(timeout, wait)
+        readers = [r for r in self._requests if not r.want_write]
+        writers = [r for r in self._requests if r.want_write]
+        try:
+            readable, writable, _ = select.select(readers, writers, [], timeout)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        ready = set(readable) | set(writable)
+        now = time.time()
+        for request in list(self._requests):
+            if request in ready:
+                try:
+                    if not request.on_ready():
+                        continue
+                    response = request.response()
+                    self._remove(request)
+                    request.future.set_result(response)
+                except:
+                    self._remove(request)
+                    request.future.set_exception(sys.exc_info())
+            elif request.deadline is not None and now >= request.deadline:
+                self._remove(request)
+                try:
+                    raise socket.timeout('timed out')
+                except socket.timeout:
+                    request.future.set_exception(sys.exc_info())
+
+    def _remove(self, request):
+        self._requests.remove(request)
+        request.close()
+
+    def run_until_complete(self, futures):
+        """
+        Runs the loop until every future in the given list is done.
+
+        """
+        while [f for f in futures if not f.done()]:
+            if not self._requests:
+                raise RuntimeError('Futures can not complete: no requests are in flight.')
+            self.run_once()
+
+    def run(self):
+        """
+        Runs the loop until no requests are left in flight.
+
+        """
+        while self._requests:
+            self.run_once()
@@ -4,6 +4,10 @@
 # temboo.core.exception.TembooHTTPError
 # temboo.core.exception.TembooCredentialError
 # temboo.core.exception.TembooObjectNotAccessibleError
+# temboo.core.exception.TembooConnectionError
+# temboo.core.exception.TembooCircuitOpenError
+# temboo.core.exception.TembooRateLimitError
+# temboo.core.exception.TembooPageLimitError
 #
 # Classes for handling Temboo-related exceptions.
 #
@@ -48,3 +52,19 @@ class TembooHTTPError(TembooError):
         self.args = (msg, status, reason, response_body)
 
 
+class TembooConnectionError(TembooError):
+    pass
+
+
+class TembooCircuitOpenError(TembooError):
+    pass
+
+
+class TembooRateLimitError(TembooError):
+    def __init__(self, msg, retry_after):
+        TembooError.__init__(self, msg)
+        self.retry_after = retry_after
+
+
+class TembooPageLimitError(TembooError):
+    pass
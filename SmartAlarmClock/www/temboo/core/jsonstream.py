@@ -0,0 +1,371 @@
+###############################################################################
+#
+# temboo.core.jsonstream.parse
+# temboo.core.jsonstream.items
+# temboo.core.jsonstream.output_items
+#
+# Incremental JSON parsing, for handling large choreo responses as they
+# arrive instead of reading and decoding them all at once.
+#
+# Python version 2.6
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+#
+###############################################################################
+
+
+import codecs
+import itertools
+import re
+import sys
+
+from temboo.core.exception import TembooError
+from temboo.core.util import ExecutionStatus
+
+
+_WHITESPACE = u' \t\n\r'
+_PLAIN = re.compile(ur'[^"\\]*')
+_NUMBER = re.compile(ur'[-+0-9.eE]*')
+_ESCAPES = {u'"': u'"', u'\\': u'\\', u'/': u'/', u'b': u'\b',
+            u'f': u'\f', u'n': u'\n', u'r': u'\r', u't': u'\t'}
+_LITERALS = {u't': (u'true', True), u'f': (u'false', False), u'n': (u'null', None)}
+
+
+def _unichr(code):
+    """
+    unichr() that also works for astral code points on narrow builds.
+
+    """
+    if code < 0x10000 or sys.maxunicode > 0xffff:
+        return unichr(code)
+    code -= 0x10000
+    return unichr(0xd800 + (code >> 10)) + unichr(0xdc00 + (code & 0x3ff))
+
+
+def _decode_escape(buf, i):
+    """Decodes the escape sequence starting with the backslash at buf[i].
+
+    Returns a (text, end) tuple, or None if buf ends before the escape
+    sequence does.
+
+    """
+    if i + 1 >= len(buf):
+        return None
+    c = buf[i + 1]
+    if c != u'u':
+        if c not in _ESCAPES:
+            raise ValueError('Invalid \\escape: {0!r}'.format(c))
+        return _ESCAPES[c], i + 2
+    if i + 6 > len(buf):
+        return None
+    code = int(buf[i + 2:i + 6], 16)
+    if 0xd800 <= code < 0xdc00:
+        #A high surrogate may be followed by its low surrogate.
+        if i + 7 > len(buf):
+            return None
+        if buf[i + 6] == u'\\':
+            if i + 12 > len(buf):
+                return None
+            if buf[i + 7] == u'u':
+                low = int(buf[i + 8:i + 12], 16)
+                if 0xdc00 <= low < 0xe000:
+                    return _unichr(0x10000 + ((code - 0xd800) << 10) + (low - 0xdc00)), i + 12
+    return unichr(code), i + 6
+
+
+class _Reader(object):
+    """
+    Reads JSON tokens from an iterable of string chunks.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = u''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """
+        Appends the next chunk to the buffer. Returns False at end of input.
+
+        """
+        while not self._eof:
+            try:
+                chunk = self._chunks.next()
+            except StopIteration:
+                self._eof = True
+                chunk = self._decoder.decode('', True)
+            else:
+                if isinstance(chunk, str):
+                    chunk = self._decoder.decode(chunk)
+            if chunk:
+                self._buf = self._buf[self._pos:] + chunk
+                self._pos = 0
+                return True
+        return False
+
+    def _ensure(self, count):
+        while len(self._buf) - self._pos < count:
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON input')
+
+    def peek(self):
+        """
+        Returns the next non-whitespace character, or '' at end of input.
+
+        """
+        while True:
+            buf = self._buf
+            pos = self._pos
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            self._pos = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not self._fill():
+                return u''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError('Expected {0!r} but found {1!r}'.format(char, found))
+        self._pos += 1
+
+    def string_pieces(self):
+        """
+        Reads a string, yielding its decoded contents a piece at a time.
+
+        """
+        self.expect(u'"')
+        parts = []
+        while True:
+            buf = self._buf
+            pos = self._pos
+            end = _PLAIN.match(buf, pos).end()
+            if end > pos:
+                parts.append(buf[pos:end])
+            self._pos = end
+            if end < len(buf):
+                if buf[end] == u'"':
+                    self._pos = end + 1
+                    if parts:
+                        yield u''.join(parts)
+                    return
+                escape = _decode_escape(buf, end)
+                if escape is not None:
+                    parts.append(escape[0])
+                    self._pos = escape[1]
+                    continue
+            #Out of buffered input, hand over what we have and read more.
+            if parts:
+                yield u''.join(parts)
+                parts = []
+            if not self._fill():
+                raise ValueError('Unterminated string')
+
+    def string(self):
+        return u''.join(self.string_pieces())
+
+    def number(self):
+        while True:
+            match = _NUMBER.match(self._buf, self._pos)
+            if match.end() < len(self._buf) or not self._fill():
+                break
+        text = match.group()
+        self._pos = match.end()
+        if not text:
+            raise ValueError('Expected a value')
+        if u'.' in text or u'e' in text or u'E' in text:
+            return float(text)
+        return int(text)
+
+    def literal(self):
+        c = self.peek()
+        if c not in _LITERALS:
+            raise ValueError('Expected a value but found {0!r}'.format(c))
+        word, value = _LITERALS[c]
+        self._ensure(len(word))
+        if self._buf[self._pos:self._pos + len(word)] != word:
+            raise ValueError('Expected {0!r}'.format(word))
+        self._pos += len(word)
+        return value
+
+
+def _join(prefix, name):
+    return prefix + u'.' + name if prefix else name
+
+
+def _value(reader, prefix, stream):
+    c = reader.peek()
+    if c == u'{':
+        reader.expect(u'{')
+        yield prefix, 'start_map', None
+        if reader.peek() == u'}':
+            reader.expect(u'}')
+        else:
+            while True:
+                key = reader.string()
+                reader.expect(u':')
+                yield prefix, 'map_key', key
+                for event in _value(reader, _join(prefix, key), stream):
+                    yield event
+                if reader.peek() != u',':
+                    break
+                reader.expect(u',')
+            reader.expect(u'}')
+        yield prefix, 'end_map', None
+    elif c == u'[':
+        reader.expect(u'[')
+        yield prefix, 'start_array', None
+        if reader.peek() == u']':
+            reader.expect(u']')
+        else:
+            item = _join(prefix, u'item')
+            while True:
+                for event in _value(reader, item, stream):
+                    yield event
+                if reader.peek() != u',':
+                    break
+                reader.expect(u',')
+            reader.expect(u']')
+        yield prefix, 'end_array', None
+    elif c == u'"':
+        if prefix in stream:
+            for piece in reader.string_pieces():
+                yield prefix, 'string_piece', piece
+        else:
+            yield prefix, 'string', reader.string()
+    elif c == u'-' or c.isdigit():
+        yield prefix, 'number', reader.number()
+    elif c:
+        value = reader.literal()
+        yield prefix, 'null' if value is None else 'boolean', value
+    else:
+        raise ValueError('Unexpected end of JSON input')
+
+
+def parse(chunks, stream_prefixes=()):
+    """Parses a JSON document incrementally.
+
+    chunks          -- an iterable of str (UTF-8) or unicode pieces of the
+                       document, e.g. as they are read from a socket.
+    stream_prefixes -- prefixes of string values that should be reported
+                       a piece at a time rather than as a whole.
+                       (default: none)
+
+    Returns a generator of (prefix, event, value) tuples. The prefix is
+    the dotted path to the value, with 'item' standing for array elements
+    (e.g. 'items.item.start'). Events are start_map, map_key, end_map,
+    start_array, end_array, string, number, boolean, null, and
+    string_piece for strings under stream_prefixes.
+
+    """
+    reader = _Reader(chunks)
+    for event in _value(reader, u'', frozenset(stream_prefixes)):
+        yield event
+    if reader.peek():
+        raise ValueError('Extra data after JSON document')
+
+
+def _build(start, events):
+    """
+    Builds the container begun by the start event from the following events.
+
+    """
+    root = {} if start == 'start_map' else []
+    stack = [[root, None]]
+    for prefix, event, value in events:
+        frame = stack[-1]
+        if event == 'map_key':
+            frame[1] = value
+            continue
+        if event in ('end_map', 'end_array'):
+            stack.pop()
+            if not stack:
+                return root
+            continue
+        if event == 'start_map':
+            value = {}
+        elif event == 'start_array':
+            value = []
+        if isinstance(frame[0], dict):
+            frame[0][frame[1]] = value
+        else:
+            frame[0].append(value)
+        if event in ('start_map', 'start_array'):
+            stack.append([value, None])
+    raise ValueError('Unexpected end of JSON input')
+
+
+def items(chunks, prefix):
+    """Yields each value found at prefix in a JSON document as it is parsed.
+
+    chunks -- an iterable of pieces of the document (see parse).
+    prefix -- the dotted path of the values to yield, e.g. 'items.item'
+              for every element of the top level 'items' array.
+
+    Values are fully decoded, but only one at a time is held in memory.
+    Stopping iteration early stops reading from chunks.
+
+    """
+    events = parse(chunks)
+    for current, event, value in events:
+        if current != prefix:
+            continue
+        if event in ('start_map', 'start_array'):
+            yield _build(event, events)
+        elif event not in ('map_key', 'end_map', 'end_array', 'string_piece'):
+            yield value
+
+
+def output_items(chunks, output, prefix):
+    """Yields values from a JSON output of a choreo execution response.
+
+    Choreo outputs such as "Response" are JSON documents carried as
+    strings inside the execution response. This unescapes the output as
+    it arrives and parses it in turn, so values can be used before the
+    response has been fully received.
+
+    chunks -- an iterable of pieces of the execution response, as
+              returned by Choreography.execute_stream.
+    output -- the name of the output, e.g. 'Response'.
+    prefix -- the dotted path of the values to yield within the output,
+              e.g. 'items.item'.
+
+    Raises TembooError if the response is read to the end and the
+    execution did not succeed.
+
+    """
+    execution = {}
+    output_prefix = u'output.' + output
+
+    def pieces():
+        for current, event, value in parse(chunks, (output_prefix,)):
+            if event == 'string_piece':
+                yield value
+            elif current in (u'execution.status', u'execution.lasterror'):
+                execution[current] = value
+
+    envelope = pieces()
+    for first in envelope:
+        for item in items(itertools.chain((first,), envelope), prefix):
+            yield item
+        break
+    #Read whatever is left of the response to learn the execution status.
+    for piece in envelope:
+        pass
+    status = execution.get(u'execution.status', ExecutionStatus.SUCCESS)
+    if status != ExecutionStatus.SUCCESS:
+        raise TembooError('Choreo execution failed ({0}): {1}'.format(status, execution.get(u'execution.lasterror')))
@@ -0,0 +1,181 @@
+###############################################################################
+#
+# temboo.core.metrics.PhaseTiming
+# temboo.core.metrics.Histogram
+# temboo.core.metrics.HistogramAggregator
+#
+# Latency instrumentation for TembooSession requests.
+#
+# Python version 2.6
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+#
+###############################################################################
+
+
+import math
+import threading
+
+
+# Request phases, in the order they happen.
+CONNECT = 'connect'
+TLS = 'tls'
+WRITE = 'write'
+FIRST_BYTE = 'first_byte'
+READ = 'read'
+DECODE = 'decode'
+
+PHASES = (CONNECT, TLS, WRITE, FIRST_BYTE, READ, DECODE)
+
+
+class PhaseTiming(object):
+    """
+    How long one phase of one request took.
+
+    phase          -- one of PHASES. connect and tls only occur when a
+                      new connection is opened.
+    seconds        -- the duration of the phase.
+    path           -- the resource path requested, e.g.
+                      /choreos/Library/Google/Calendar/SearchEvents
+    status         -- the HTTP status code of the response.
+    bytes_sent     -- the size of the request body as transferred.
+    bytes_received -- the size of the response body as transferred.
+                      Both are compressed sizes if compression was used.
+    """
+
+    def __init__(self, phase, seconds, path, status, bytes_sent, bytes_received):
+        self.phase = phase
+        self.seconds = seconds
+        self.path = path
+        self.status = status
+        self.bytes_sent = bytes_sent
+        self.bytes_received = bytes_received
+
+    def __repr__(self):
+        return '<PhaseTiming {0} {1:.1f}ms {2} ({3})>'.format(
+            self.phase, self.seconds * 1000, self.path, self.status)
+
+
+class Histogram(object):
+    """
+    Counts values in fixed, logarithmically sized buckets, so that
+    percentiles can be read back (to within half a bucket, about 4.5%)
+    without keeping every value.
+    """
+
+    # Each bucket's upper bound is this many times its lower bound.
+    GROWTH = 2 ** (1 / 8.0)
+    # The upper bound of the first bucket, which holds all smaller values.
+    SMALLEST = 1e-6
+
+    def __init__(self):
+        self._counts = {}
+        self._count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        if value <= self.SMALLEST:
+            index = 0
+        else:
+            index = int(math.ceil(math.log(value / self.SMALLEST, self.GROWTH)))
+        self._counts[index] = self._counts.get(index, 0) + 1
+        self._count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def __len__(self):
+        return self._count
+
+    def percentile(self, pct):
+        """
+        Returns the value below which pct percent of samples fall, or None.
+
+        """
+        if not self._count:
+            return None
+        rank = int(round(pct / 100.0 * (self._count - 1)))
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen > rank:
+                break
+        if index == 0:
+            return self.min
+        #The middle of the bucket, on a log scale.
+        value = self.SMALLEST * self.GROWTH ** (index - 0.5)
+        return min(max(value, self.min), self.max)
+
+
+class HistogramAggregator(object):
+    """
+    A TembooSession observer that keeps a latency histogram per phase,
+    optionally split by resource path.
+    """
+
+    def __init__(self, by_path=False):
+        """Construct a new HistogramAggregator
+
+        by_path -- True to keep separate histograms for each resource
+                   path, False to combine all requests. (default False)
+
+        """
+        self.by_path = by_path
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, timing):
+        key = (timing.path if self.by_path else None, timing.phase)
+        self._lock.acquire()
+        try:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.add(timing.seconds)
+        finally:
+            self._lock.release()
+
+    def histogram(self, phase, path=None):
+        """
+        Returns the Histogram for a phase (and path if by_path), or None.
+
+        """
+        return self._histograms.get((path, phase))
+
+    def dump(self, percentiles=(50, 90, 99)):
+        """
+        Returns a text table of sample counts and percentiles, in milliseconds.
+
+        """
+        lines = []
+        self._lock.acquire()
+        try:
+            keys = sorted(self._histograms, key=lambda k: (k[0], PHASES.index(k[1])))
+            width = max([len(path or '*') for path, phase in keys] + [4])
+            row_format = '{0:<' + str(width) + '} {1:<10} {2:>6}'
+            header = [row_format.format('path', 'phase', 'count')]
+            header.extend('{0:>9}'.format('p{0}'.format(p)) for p in percentiles)
+            lines.append(' '.join(header))
+            for path, phase in keys:
+                histogram = self._histograms[(path, phase)]
+                row = [row_format.format(path or '*', phase, len(histogram))]
+                row.extend('{0:>9.1f}'.format(histogram.percentile(p) * 1000) for p in percentiles)
+                lines.append(' '.join(row))
+        finally:
+            self._lock.release()
+        return '\n'.join(lines)
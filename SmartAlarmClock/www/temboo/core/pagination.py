@@ -0,0 +1,142 @@
+###############################################################################
+#
+# temboo.core.pagination.paginate
+#
+# Iterating over every item of a paged choreo response, fetching the next
+# page in the background while the current one is consumed.
+#
+# Python version 2.6
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+#
+###############################################################################
+
+
+import sys
+import threading
+
+from temboo.core.exception import TembooError
+from temboo.core.exception import TembooPageLimitError
+from temboo.core.util import ExecutionStatus
+
+
+class _PageFetch(object):
+    """
+    A page request running on its own thread.
+    """
+
+    def __init__(self, fetch, token):
+        self._fetch = fetch
+        self._token = token
+        self._page = None
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._page = self._fetch(self._token)
+        except:
+            self._exc_info = sys.exc_info()
+
+    def get(self):
+        """
+        Waits for the page, returning it or re-raising the fetch's error.
+
+        """
+        self._thread.join()
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._page
+
+
+class _PageNow(object):
+    """
+    A page request made when its result is asked for.
+    """
+
+    def __init__(self, fetch, token):
+        self._fetch = fetch
+        self._token = token
+
+    def get(self):
+        return self._fetch(self._token)
+
+
+def paginate(choreo, choreo_inputs=None, page_size=None, prefetch=True, output='Response',
+             items_key='items', token_key='nextPageToken', max_pages=None):
+    """Yields every item of a paged Google API choreo's results.
+
+    Pages are requested with the PageToken input, which is set from the
+    token_key field of the previous page. Choreos whose input sets have
+    no set_PageToken (e.g. Calendar's GetAllEvents) return a single page.
+
+    choreo        -- a Choreography, e.g. SearchEvents.
+    choreo_inputs -- its InputSet, which is copied rather than changed.
+                     (default None)
+    page_size     -- the MaxResults input for each page, if the choreo
+                     has one, or None to leave it to the server.
+                     (default None)
+    prefetch      -- True to request the next page on another thread as
+                     soon as a page arrives, so it is ready (or nearly)
+                     by the time the current page has been consumed.
+                     (default True)
+    output        -- the name of the JSON output holding each page.
+                     (default 'Response')
+    items_key     -- the field of a page holding its list of items.
+                     (default 'items')
+    token_key     -- the field of a page holding the next page's token.
+                     (default 'nextPageToken')
+    max_pages     -- the most pages to request, or None for no limit.
+                     (default None)
+
+    Stopping iteration stops fetching pages; with prefetch, at most the
+    one page already requested is discarded. Raises TembooError if a
+    page's execution fails, and TembooPageLimitError after the items of
+    the last page allowed by max_pages if there are more pages.
+
+    """
+    template = choreo.new_input_set()
+    if choreo_inputs is not None:
+        template._set_inputs(choreo_inputs.inputs)
+        template.preset_uri = choreo_inputs.preset_uri
+    if page_size is not None and hasattr(template, 'set_MaxResults'):
+        template.set_MaxResults(page_size)
+    paged = hasattr(template, 'set_PageToken')
+
+    def fetch(token):
+        inputs = choreo.new_input_set()
+        inputs._set_inputs(template.inputs)
+        inputs.preset_uri = template.preset_uri
+        if token is not None:
+            inputs.set_PageToken(token)
+        result = choreo.execute_with_results(inputs, lazy=True)
+        if result.status != ExecutionStatus.SUCCESS:
+            raise TembooError('Choreo execution failed ({0}): {1}'.format(result.status, result._exec_data.get('lasterror')))
+        page = result.get_json(output) or {}
+        return page.get(items_key) or [], page.get(token_key) if paged else None
+
+    request = _PageNow(fetch, None)
+    requested = 1
+    while request is not None:
+        items, token = request.get()
+        request = None
+        if token and (max_pages is None or requested < max_pages):
+            request = (_PageFetch if prefetch else _PageNow)(fetch, token)
+            requested += 1
+        for item in items:
+            yield item
+        if token and request is None:
+            raise TembooPageLimitError('More than {0} page(s) of results'.format(max_pages))
@@ -0,0 +1,136 @@
+###############################################################################
+#
+# temboo.core.ratelimit.RateLimiter
+#
+# Token bucket limits on choreo executions, shared by every process on a
+# host through a locked state file.
+#
+# Python version 2.6
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+#
+###############################################################################
+
+
+import os
+import tempfile
+import time
+
+from temboo.core.exception import TembooRateLimitError
+from temboo.core.util import StateFile
+
+
+STATE_FILE = os.path.join(tempfile.gettempdir(), 'temboo-ratelimit.json')
+
+#Buckets unused for this long are dropped from the state file.
+_EXPIRY = 7 * 24 * 3600
+
+
+class RateLimiter(object):
+    """
+    Limits how often choreos are executed, across all processes on the
+    host that use the same state file.
+
+    Limits are token buckets given as (requests, seconds) tuples: at most
+    requests executions in a burst, with the allowance refilling evenly
+    over seconds. E.g. (60, 3600) allows bursts of up to 60 executions
+    and a sustained rate of 60 an hour.
+    """
+
+    def __init__(self, account_limit=None, choreo_limits=None, block=True, max_wait=10.0, path=STATE_FILE):
+        """Construct a new RateLimiter
+
+        account_limit -- the limit on all choreo executions of an
+                         account, or None for no account-wide limit.
+                         (default None)
+        choreo_limits -- a dict of limits per choreo, keyed by choreo
+                         path, e.g. '/Library/Google/Calendar/SearchEvents'.
+                         (default None)
+        block         -- True to wait for the allowance to refill when a
+                         limit is reached, False to fail straight away.
+                         (default True)
+        max_wait      -- the longest a blocking acquire waits before
+                         failing. (default 10 seconds)
+        path          -- the state file shared by cooperating processes.
+                         (default temboo-ratelimit.json in the
+                         temporary directory)
+
+        """
+        self.account_limit = account_limit
+        self.choreo_limits = dict(choreo_limits or {})
+        self.block = block
+        self.max_wait = max_wait
+        self.path = path
+        self._state = StateFile(path)
+
+    def _limits(self, account, choreo):
+        """
+        Returns the (bucket key, limit) pairs that apply to an execution.
+
+        """
+        limits = []
+        if self.account_limit is not None:
+            limits.append((account, self.account_limit))
+        if choreo in self.choreo_limits:
+            limits.append((account + ' ' + choreo, self.choreo_limits[choreo]))
+        return limits
+
+    def acquire(self, account, choreo):
+        """Takes one execution from the account's and the choreo's allowance.
+
+        account -- identifies the Temboo account, e.g. 'org/appkeyname'.
+        choreo  -- the choreo path, e.g. '/Library/Google/Gmail/InboxFeed'.
+
+        Raises TembooRateLimitError if a limit has been reached and either
+        block is False or the allowance won't refill within max_wait.
+
+        """
+        limits = self._limits(account, choreo)
+        if not limits:
+            return
+        deadline = time.time() + (self.max_wait if self.block else 0)
+        while True:
+            wait = self._take(limits)
+            if wait <= 0:
+                return
+            if time.time() + wait > deadline:
+                raise TembooRateLimitError('Rate limit reached for {0}. Try again in {1:.1f} seconds.'.format(choreo, wait), wait)
+            time.sleep(wait)
+
+    def _take(self, limits):
+        """
+        Takes a token from every bucket if they all have one. Returns 0 on
+        success, otherwise the seconds until they will.
+
+        """
+        def take(state):
+            #A new (or cut short) state file starts with full buckets.
+            now = time.time()
+            wait = 0.0
+            buckets = []
+            for key, (capacity, period) in limits:
+                tokens, updated = state.get(key, (capacity, now))
+                rate = float(capacity) / period
+                tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+                buckets.append((key, tokens))
+            if wait <= 0:
+                buckets = [(key, tokens - 1) for key, tokens in buckets]
+            for key, tokens in buckets:
+                state[key] = (tokens, now)
+            for key in [k for k, v in state.items() if now - v[1] > _EXPIRY]:
+                del state[key]
+            return wait
+        return self._state.update(take)
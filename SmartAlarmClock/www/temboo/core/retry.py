@@ -0,0 +1,191 @@
+###############################################################################
+#
+# temboo.core.retry.RetryPolicy
+# temboo.core.retry.CircuitBreaker
+#
+# Retrying of transient Temboo request failures, and failing fast while
+# the Temboo server is unreachable.
+#
+# Python version 2.6
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+#
+###############################################################################
+
+
+import httplib
+import socket
+import threading
+import time
+
+from temboo.core.exception import TembooCircuitOpenError
+from temboo.core.exception import TembooConnectionError
+from temboo.core.exception import TembooHTTPError
+from temboo.core.util import PollPolicy
+
+
+# Choreos that only read data, and so are safe to execute more than once.
+READ_ONLY_CHOREOS = frozenset([
+    '/Library/Google/Calendar/GetAllCalendars',
+    '/Library/Google/Calendar/GetAllEvents',
+    '/Library/Google/Calendar/GetAllSettings',
+    '/Library/Google/Calendar/GetCalendar',
+    '/Library/Google/Calendar/GetEvent',
+    '/Library/Google/Calendar/GetNextEvent',
+    '/Library/Google/Calendar/GetSetting',
+    '/Library/Google/Calendar/SearchCalendarsByName',
+    '/Library/Google/Calendar/SearchEvents',
+    '/Library/Google/Gmail/GetUnreadImportantEmail',
+    '/Library/Google/Gmail/GetUnreadMail',
+    '/Library/Google/Gmail/GetUnreadMailFromSender',
+    '/Library/Google/Gmail/GetUnreadMailWithLabel',
+    '/Library/Google/Gmail/InboxFeed',
+])
+
+CHOREOS_PATH = '/choreos'
+
+
+def is_transient(error, statuses=(429, 500, 502, 503, 504)):
+    """Returns True if a request error may go away when retried.
+
+    That is any failure to connect or to read a response, and HTTP errors
+    with a status code in statuses.
+
+    """
+    if isinstance(error, TembooHTTPError):
+        return error.args[1] in statuses
+    return isinstance(error, (TembooConnectionError, httplib.HTTPException, socket.error))
+
+
+class RetryPolicy(object):
+    """
+    Decides which failed requests a TembooSession retries, and when.
+    """
+
+    def __init__(self, max_attempts=3, deadline=20.0, backoff=None,
+                 statuses=(429, 500, 502, 503, 504), read_only_choreos=READ_ONLY_CHOREOS):
+        """Construct a new RetryPolicy
+
+        max_attempts      -- the most times a request is tried, including
+                             the first attempt. (default 3)
+        deadline          -- seconds a request may take in total, over all
+                             attempts. Each attempt's socket timeout is
+                             capped to what is left. None for no limit.
+                             (default 20)
+        backoff           -- a PollPolicy for the waits between attempts.
+                             (default PollPolicy(0.5, 2, 5))
+        statuses          -- HTTP status codes worth retrying.
+                             (default 429 and 5xx gateway/server errors)
+        read_only_choreos -- paths of choreos that are safe to run twice.
+                             (default READ_ONLY_CHOREOS)
+
+        """
+        self.max_attempts = max(1, int(max_attempts))
+        self.deadline = deadline
+        self.backoff = backoff if backoff is not None else PollPolicy(0.5, 2.0, 5.0)
+        self.statuses = tuple(statuses)
+        self.read_only_choreos = frozenset(read_only_choreos)
+
+    def is_idempotent(self, http_method, path, parameters=None):
+        """
+        Returns True if repeating the request can't change anything.
+
+        """
+        if http_method == 'GET':
+            return True
+        if parameters and parameters.get('mode') == 'async':
+            return False
+        return (path.startswith(CHOREOS_PATH + '/') and
+                path[len(CHOREOS_PATH):] in self.read_only_choreos)
+
+    def is_transient(self, error):
+        return is_transient(error, self.statuses)
+
+
+class CircuitBreaker(object):
+    """
+    Stops sending requests for a while after several consecutive transient
+    failures, so that callers fail immediately during an outage instead of
+    each waiting for their own timeouts.
+
+    After reset_timeout seconds one trial request is let through; if it
+    succeeds the circuit closes again, otherwise it stays open.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        """Construct a new CircuitBreaker
+
+        failure_threshold -- consecutive failures that open the circuit.
+                             (default 5)
+        reset_timeout     -- seconds the circuit stays open before a
+                             trial request is allowed. (default 60)
+
+        """
+        self.failure_threshold = int(failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened is not None
+
+    def before_request(self):
+        """
+        Raises TembooCircuitOpenError if the request should not be sent.
+
+        """
+        self._lock.acquire()
+        try:
+            if self._opened is None:
+                return
+            if not self._trial and time.time() - self._opened >= self.reset_timeout:
+                self._trial = True
+                return
+        finally:
+            self._lock.release()
+        raise TembooCircuitOpenError('Not contacting the Temboo server after {0} consecutive failures. Retrying in at most {1:.0f} seconds.'.format(self._failures, self.reset_timeout))
+
+    def cancel_request(self):
+        """
+        Forgets a request allowed by before_request() that was never
+        sent, so that it doesn't hold up the next trial request.
+
+        """
+        self._lock.acquire()
+        try:
+            self._trial = False
+        finally:
+            self._lock.release()
+
+    def record_success(self):
+        self._lock.acquire()
+        try:
+            self._failures = 0
+            self._opened = None
+            self._trial = False
+        finally:
+            self._lock.release()
+
+    def record_failure(self):
+        self._lock.acquire()
+        try:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened = time.time()
+            self._trial = False
+        finally:
+            self._lock.release()
@@ -25,14 +25,50 @@
 
 
 import base64
+import errno
 import httplib
 import json
+import socket
+import ssl
+import sys
+import time
+import zlib
 from urllib import urlencode
 
+from temboo.core import metrics
+from temboo.core.compression import ACCEPT_ENCODING
+from temboo.core.compression import CompressionStats
+from temboo.core.compression import Decoder
+from temboo.core.compression import compress
+from temboo.core.connection import get_pool
+from temboo.core.eventloop import EventLoop
+from temboo.core.eventloop import Future
 from temboo.core.exception import TembooError
 from temboo.core.exception import TembooHTTPError
+from temboo.core.exception import TembooConnectionError
 from temboo.core.exception import TembooCredentialError
 from temboo.core.exception import TembooObjectNotAccessibleError
+from temboo.core.exception import TembooRateLimitError
+from temboo.core.retry import CHOREOS_PATH
+from temboo.core.retry import RetryPolicy
+from temboo.core.retry import is_transient
+
+
+#Decides which requests are idempotent for sessions without a retry policy.
+_DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def _nothing_received(error):
+    """
+    Returns True if a request failed before any of its response arrived:
+    the server hung up without a status line or reset the connection.
+
+    """
+    if isinstance(error, httplib.BadStatusLine):
+        return True
+    if isinstance(error, socket.timeout):
+        return False
+    return isinstance(error, socket.error) and error.errno in (errno.ECONNRESET, errno.EPIPE)
 
 
 class TembooSession(object):
@@ -43,7 +79,7 @@ class TembooSession(object):
     SESSION_BASE_PATH = '/arcturus-web/api-1.0'
     SOURCE_ID="PythonSDK_1.76"
     
-    def __init__(self, organization, appkeyname, appkey, domain='master', base_host='temboolive.com', port="443", secure=True):
+    def __init__(self, organization, appkeyname, appkey, domain='master', base_host='temboolive.com', port="443", secure=True, pool=None, cache=None, observers=None, retry_policy=None, circuit_breaker=None, compression=True, compress_min_size=None, ssl_context=None, rate_limiter=None, token_cache=None):
         """Construct a new TembooSession
     
         organization -- the organization name you used when
@@ -64,6 +100,36 @@ class TembooSession(object):
                         443 for secure (https) connections. (default "443")
         secure       -- True = use secure (https) connections (default)
                         False = use unsecure (http) connections.
+        pool         -- a ConnectionPool to take connections from.
+                        (default: the shared pool for base_host/port
+                        and ssl_context)
+        cache        -- a ResponseCache that choreo executions may be
+                        answered from. (default None, no caching)
+        observers    -- a list of callables that are passed a
+                        metrics.PhaseTiming for every phase of every
+                        request, e.g. a metrics.HistogramAggregator.
+                        (default None)
+        retry_policy -- a RetryPolicy for retrying idempotent requests
+                        that fail transiently. (default None, no retries)
+        circuit_breaker -- a CircuitBreaker that makes requests fail
+                        fast with TembooCircuitOpenError while the
+                        server is unreachable. (default None)
+        compression  -- True to ask for gzip or deflate compressed
+                        responses, which are decoded transparently.
+                        (default True)
+        compress_min_size -- request bodies of at least this many bytes
+                        are sent gzip compressed. Only use this with a
+                        server that accepts compressed requests.
+                        (default None, never compress requests)
+        ssl_context  -- the ssl.SSLContext for secure connections.
+                        (default: one context shared by all sessions,
+                        so CA certificates are loaded only once)
+        rate_limiter -- a RateLimiter consulted before every choreo
+                        execution, which waits or raises
+                        TembooRateLimitError when a limit is reached.
+                        (default None, no limits)
+        token_cache  -- a TokenCache for reusing the OAuth access tokens
+                        choreos return. (default None)
 
         """
         
@@ -78,6 +144,17 @@ class TembooSession(object):
             self._host = '{0}:{1}'.format(base_host, str(port))
         else:
             self._host = '{0}.{1}:{2}'.format(organization, base_host, str(port))
+        self._pool = pool if pool is not None else get_pool(self._host, self._secure, ssl_context)
+        self.ssl_context = self._pool.ssl_context
+        self.cache = cache
+        self._observers = list(observers or [])
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.rate_limiter = rate_limiter
+        self.token_cache = token_cache
+        self._account = '{0}/{1}'.format(organization, appkeyname)
+        self.compress_min_size = compress_min_size
+        self.compression_stats = CompressionStats()
         self._session_base_path = TembooSession.SESSION_BASE_PATH
         self._headers = {
             'Accept': 'application/json',
@@ -85,61 +162,356 @@ class TembooSession(object):
             'x-temboo-domain': '{0}/{1}'.format(organization, domain),
             'Authorization':'Basic {0}'.format(base64.b64encode(appkeyname + ':' + appkey))
         }
+        if compression:
+            self._headers['Accept-Encoding'] = ACCEPT_ENCODING
 
  
 
-    def _do_request(self, http_method, path, body=None, parameters=None):
+    def _do_request(self, http_method, path, body=None, parameters=None, decode=True):
         """
         Generic HTTP/S connection method.
         
         """
+        body, headers = self._encode_body(body)
+        return self._with_retries(http_method, path, parameters,
+            lambda timeout: self._do_request_once(http_method, path, body, parameters, decode, timeout, headers))
+
+
+    def _with_retries(self, http_method, path, parameters, attempt):
+        """
+        Calls attempt(timeout) until it succeeds, as allowed by the
+        retry policy, and reports each outcome to the circuit breaker.
+
+        """
+        policy = self.retry_policy
+        if policy is None or not policy.is_idempotent(http_method, path, parameters):
+            return self._guarded(http_method, path, attempt, None)
+
+        deadline = time.time() + policy.deadline if policy.deadline is not None else None
+        delays = policy.backoff.delays()
+        tries = 1
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0.1, deadline - time.time())
+            try:
+                return self._guarded(http_method, path, attempt, timeout)
+            except Exception, e:
+                if tries >= policy.max_attempts or not policy.is_transient(e):
+                    raise
+                delay = delays.next()
+                if deadline is not None and time.time() + delay >= deadline:
+                    raise
+            time.sleep(delay)
+            tries += 1
 
-        full_path = self._session_base_path + path
-        
-        #If any parameters were given, tack them on to the end of the path.
-        if parameters:
-            full_path += '?' + urlencode(parameters)
 
-        conn = None
-        response = None
+    def _guarded(self, http_method, path, attempt, timeout):
+        """
+        Makes one attempt at a request, once the circuit breaker and the
+        rate limiter allow it.
+
+        """
+        breaker = self.circuit_breaker
+        #The breaker is asked first, so that requests it fails fast don't
+        #use up the rate limiter's allowance.
+        if breaker is not None:
+            breaker.before_request()
+        if (self.rate_limiter is not None and http_method == 'POST' and
+                path.startswith(CHOREOS_PATH + '/')):
+            try:
+                self.rate_limiter.acquire(self._account, path[len(CHOREOS_PATH):])
+            except:
+                if breaker is not None:
+                    breaker.cancel_request()
+                raise
+        if breaker is None:
+            return attempt(timeout)
+        recorded = False
         try:
-            #TO DO: Rewrite to facilitate connection pooling.
-            if self._secure:
-                conn = httplib.HTTPSConnection(self._host)
+            result = attempt(timeout)
+            recorded = True
+            breaker.record_success()
+            return result
+        except Exception, e:
+            recorded = True
+            #Errors such as a bad credential still mean the server is up.
+            if is_transient(e):
+                breaker.record_failure()
             else:
-                conn = httplib.HTTPConnection(self._host)
+                breaker.record_success()
+            raise
+        finally:
+            #E.g. a KeyboardInterrupt says nothing about the server, but a
+            #trial request it cut short mustn't keep the circuit open.
+            if not recorded:
+                breaker.cancel_request()
+
+
+    def _do_request_once(self, http_method, path, body=None, parameters=None, decode=True, timeout=None, headers=None):
+        """
+        Makes a single HTTP/S request.
+
+        timeout -- socket timeout for this request, or None for the
+                   pool's default.
+        headers -- the request headers, or None for the session's.
+
+        """
+        full_path = self._full_path(path, parameters)
+        bytes_sent = len(body) if body else 0
+
+        timings = []
+        conn, response = self._open(http_method, full_path, body, timings, timeout, headers,
+                                    self._is_idempotent(http_method, path, parameters))
+        start = time.time()
+        try:
+            data = response.read()
+        except:
+            conn.close()
+            raise
+        self._pool.release(conn, not response.will_close)
+        try:
+            body = self._decode_body(response, data)
+            timings.append((metrics.READ, time.time() - start))
+            start = time.time()
+            result = self._handle_response(response, body, path, decode)
+            if decode:
+                timings.append((metrics.DECODE, time.time() - start))
+            return result
+        finally:
+            self._emit(timings, path, response.status, bytes_sent, len(data))
+
+
+    def _encode_body(self, body):
+        """
+        Compresses a request body if it is at least compress_min_size
+        bytes long. Returns the body to send and the headers to send it
+        with.
+
+        """
+        size = len(body) if body else 0
+        headers = self._headers
+        if size and self.compress_min_size is not None and size >= self.compress_min_size:
+            compressed = compress(body)
+            #Incompressible bodies are sent as they are.
+            if len(compressed) < size:
+                body = compressed
+                headers = dict(headers)
+                headers['Content-Encoding'] = 'gzip'
+        self.compression_stats.add_request(size, len(body) if body else 0)
+        return body, headers
+
+
+    def _decode_body(self, response, data):
+        """
+        Returns a response body with its content coding removed.
+
+        """
+        decoder = Decoder(response.getheader('Content-Encoding'))
+        try:
+            body = decoder.decode(data) + decoder.flush()
+        except zlib.error, e:
+            raise TembooError('Could not decode the {0} response from the Temboo server: {1}'.format(decoder.encoding, e))
+        self.compression_stats.add_response(len(body), len(data), decoder.encoding is not None)
+        return body
+
+
+    def add_observer(self, observer):
+        """Registers a request timing observer.
+
+        observer -- a callable that is passed a metrics.PhaseTiming for
+                    every phase of every request made by this session.
+
+        """
+        self._observers.append(observer)
+
+
+    def _emit(self, timings, path, status, bytes_sent, bytes_received):
+        """
+        Passes the phase timings of a finished request to the observers.
+
+        """
+        for observer in self._observers:
+            for phase, seconds in timings:
+                observer(metrics.PhaseTiming(phase, seconds, path, status, bytes_sent, bytes_received))
 
+
+    def _open(self, http_method, full_path, body, timings, timeout=None, headers=None, idempotent=False):
+        """
+        Sends a request on a pooled connection.
+
+        Returns a (connection, response) tuple. The caller must read the
+        response and then release the connection back to the pool (or
+        close it). Phase timings are appended to the timings list.
+
+        A request that fails on a kept-alive connection the server has
+        since closed is sent once more on a new connection, but only if
+        it can't have run: either it couldn't be written, or it is
+        idempotent and no response came back at all.
+
+        """
+        conn, reused = self._pool.acquire()
+        try:
             try:
-                conn.request(http_method, full_path, body, self._headers)
+                return conn, self._send(conn, http_method, full_path, body, timings, timeout, headers)
+            except TembooConnectionError:
+                #The request couldn't be written, so it never reached the
+                #server.
+                if not reused:
+                    raise
+            except (httplib.HTTPException, socket.error), e:
+                #The request was written and may be running. A timeout or
+                #a partial response always means giving up.
+                if not (reused and idempotent and _nothing_received(e)):
+                    raise
+            conn.close()
+            conn, reused = self._pool.acquire(fresh=True)
+            del timings[:]
+            return conn, self._send(conn, http_method, full_path, body, timings, timeout, headers)
+        except:
+            conn.close()
+            raise
+
+
+    def _is_idempotent(self, http_method, path, parameters=None):
+        """
+        Returns True if sending a request twice can't change anything.
+
+        """
+        policy = self.retry_policy if self.retry_policy is not None else _DEFAULT_RETRY_POLICY
+        return policy.is_idempotent(http_method, path, parameters)
+
+
+    def _do_request_stream(self, http_method, path, body=None, parameters=None, chunk_size=8192):
+        """
+        Generic HTTP/S method returning the response body a chunk at a time.
+
+        """
+        body, headers = self._encode_body(body)
+        return self._with_retries(http_method, path, parameters,
+            lambda timeout: self._open_stream(http_method, path, body, parameters, chunk_size, timeout, headers))
+
+
+    def _open_stream(self, http_method, path, body, parameters, chunk_size, timeout=None, headers=None):
+        """
+        Sends a request and checks its status, returning a generator
+        over the response body.
+
+        """
+        full_path = self._full_path(path, parameters)
+        bytes_sent = len(body) if body else 0
+        timings = []
+        conn, response = self._open(http_method, full_path, body, timings, timeout, headers,
+                                    self._is_idempotent(http_method, path, parameters))
+        if not 200 <= response.status < 300:
+            try:
+                data = response.read()
             except:
-                raise TembooError('An error occurred connecting to the Temboo server. Verify that your Temboo Account Name is correct, and that you have a functioning network connection')
-
-            response = conn.getresponse()
-            body = response.read()
-           
-            #Any 200-series response means success.
-            if 200 <= response.status < 300:
-                return json.loads(body)
-
-            #401 errors are appkeyname/appkey errors
-            if response.status == 401:
-                msg = json.loads(body)['error']
-                raise TembooCredentialError(msg)
-        
-            #404 errors are "object not found" (or permissions errors)
-            #NOTE: Malformed URIs can result in a 404, too, but the 
-            #body text won't be a JSON string.
-            if response.status == 404 and body.startswith("{"):
-                msg = json.loads(body)['error']
-                raise TembooObjectNotAccessibleError(msg, path)
+                conn.close()
+                raise
+            self._pool.release(conn, not response.will_close)
+            self._emit(timings, path, response.status, bytes_sent, len(data))
+            self._handle_response(response, self._decode_body(response, data), path)
+        return self._iter_body(conn, response, chunk_size, path, timings, bytes_sent)
 
-            #Any response < 200 or >= 300 means an error.
-            msg = 'Bad HTTP response code. ({0})'.format(response.status)
-            raise TembooHTTPError(msg, response.status, response.reason, body)
 
+    def _iter_body(self, conn, response, chunk_size, path, timings, bytes_sent):
+        decoder = Decoder(response.getheader('Content-Encoding'))
+        complete = False
+        received = 0
+        decoded = 0
+        reading = 0.0
+        try:
+            while True:
+                start = time.time()
+                data = response.read(chunk_size)
+                try:
+                    chunk = decoder.decode(data) if data else decoder.flush()
+                except zlib.error, e:
+                    raise TembooError('Could not decode the {0} response from the Temboo server: {1}'.format(decoder.encoding, e))
+                reading += time.time() - start
+                received += len(data)
+                decoded += len(chunk)
+                if chunk:
+                    yield chunk
+                if not data:
+                    break
+            complete = True
         finally:
-            if conn is not None:
+            #A connection can only be reused once its response has been
+            #read to the end.
+            if complete:
+                self._pool.release(conn, not response.will_close)
+            else:
                 conn.close()
+            #The read phase only counts time spent waiting on the socket,
+            #not time the caller spent handling each chunk.
+            timings.append((metrics.READ, reading))
+            self._emit(timings, path, response.status, bytes_sent, received)
+            self.compression_stats.add_response(decoded, received, decoder.encoding is not None)
+
+
+    def _full_path(self, path, parameters=None):
+        """
+        Returns the request URI for a resource path and query parameters.
+
+        """
+        full_path = self._session_base_path + path
+        
+        #If any parameters were given, tack them on to the end of the path.
+        if parameters:
+            full_path += '?' + urlencode(parameters)
+        return full_path
+
+
+    def _handle_response(self, response, body, path, decode=True):
+        """
+        Decodes a successful response body or raises the matching error.
+        If decode is False the raw body string is returned instead.
+
+        """
+        #Any 200-series response means success.
+        if 200 <= response.status < 300:
+            return json.loads(body) if decode else body
+
+        #401 errors are appkeyname/appkey errors
+        if response.status == 401:
+            msg = json.loads(body)['error']
+            raise TembooCredentialError(msg)
+    
+        #404 errors are "object not found" (or permissions errors)
+        #NOTE: Malformed URIs can result in a 404, too, but the 
+        #body text won't be a JSON string.
+        if response.status == 404 and body.startswith("{"):
+            msg = json.loads(body)['error']
+            raise TembooObjectNotAccessibleError(msg, path)
+
+        #Any response < 200 or >= 300 means an error.
+        msg = 'Bad HTTP response code. ({0})'.format(response.status)
+        raise TembooHTTPError(msg, response.status, response.reason, body)
+
+
+    def _send(self, conn, http_method, full_path, body, timings, timeout=None, headers=None):
+        """
+        Sends a request over conn and returns the httplib response.
+
+        """
+        conn.timeout = timeout if timeout is not None else self._pool.timeout
+        try:
+            if conn.sock is None:
+                conn.connect()
+                timings.extend(getattr(conn, 'timings', ()))
+            else:
+                conn.sock.settimeout(conn.timeout)
+            start = time.time()
+            conn.request(http_method, full_path, body, headers if headers is not None else self._headers)
+            written = time.time()
+        except:
+            raise TembooConnectionError('An error occurred connecting to the Temboo server. Verify that your Temboo Account Name is correct, and that you have a functioning network connection')
+        response = conn.getresponse()
+        timings.append((metrics.WRITE, written - start))
+        timings.append((metrics.FIRST_BYTE, time.time() - written))
+        return response
 
 
     def get_content(self, path, parameters=None):
@@ -159,7 +531,7 @@ class TembooSession(object):
         return self._do_request('GET', path, parameters=parameters)
 
     
-    def post(self, path, body, parameters=None):
+    def post(self, path, body, parameters=None, decode=True):
         """Does a POST request to the server.
 
         Makes a http POST request to the URI 'path' with 'body' and
@@ -175,9 +547,126 @@ class TembooSession(object):
 
         parameters -- an optional dict of name:value entries. (Default = None)
 
+        decode -- False to return the response body as a string rather
+                  than decoding it. (Default = True)
+
         Returns a dict (the server response body, JSON-decoded.)
 
         """
-        return self._do_request('POST', path, body, parameters)
+        return self._do_request('POST', path, body, parameters, decode)
+
+
+    def post_stream(self, path, body, parameters=None, chunk_size=8192):
+        """Does a POST request to the server, streaming the response.
 
+        Takes the same arguments as post, plus:
 
+        chunk_size -- the largest number of bytes read from the
+                      socket at a time. (Default = 8192)
+
+        Error responses raise the same exceptions as post, before
+        anything is returned.
+
+        Returns a generator of the response body's chunks, decompressed
+        as they arrive. Closing the generator early closes the
+        connection.
+
+        """
+        return self._do_request_stream('POST', path, body, parameters, chunk_size)
+
+
+
+
+class AsyncTembooSession(TembooSession):
+    """
+    A TembooSession that can also run requests on non-blocking sockets,
+    so that many requests can be in flight at once from a single thread.
+    """
+
+    def __init__(self, organization, appkeyname, appkey, loop=None, timeout=60, **kwargs):
+        """Construct a new AsyncTembooSession
+
+        Takes the same arguments as TembooSession, plus:
+
+        loop    -- the EventLoop to run requests on. Sessions sharing a
+                   loop can have their requests waited on together.
+                   (default: a new EventLoop)
+        timeout -- seconds before an asynchronous request fails, or
+                   None for no limit. (default 60)
+
+        """
+        TembooSession.__init__(self, organization, appkeyname, appkey, **kwargs)
+        self.loop = loop if loop is not None else EventLoop()
+        self._timeout = timeout
+        self._hostname, port = self._host.rsplit(':', 1)
+        self._port = int(port)
+
+
+    def _do_request_async(self, http_method, path, body=None, parameters=None):
+        """
+        Generic non-blocking HTTP/S request method.
+
+        Returns a Future for the JSON-decoded response body.
+
+        A rate limiter that blocks holds up the whole event loop, so
+        asynchronous sessions should use one with block=False.
+
+        """
+        if (self.rate_limiter is not None and http_method == 'POST' and
+                path.startswith(CHOREOS_PATH + '/')):
+            try:
+                self.rate_limiter.acquire(self._account, path[len(CHOREOS_PATH):])
+            except TembooRateLimitError:
+                result = Future(self.loop)
+                result.set_exception(sys.exc_info())
+                return result
+        body, headers = self._encode_body(body)
+        lines = ['{0} {1} HTTP/1.1'.format(http_method, self._full_path(path, parameters)),
+                 'Host: {0}'.format(self._host),
+                 'Connection: close']
+        for name, value in headers.items():
+            lines.append('{0}: {1}'.format(name, value))
+        if body is not None:
+            lines.append('Content-Length: {0}'.format(len(body)))
+        data = '\r\n'.join(lines) + '\r\n\r\n' + (body or '')
+
+        future = self.loop.http_request(self._hostname, self._port, self._secure, data, self._timeout,
+                                        self.ssl_context)
+        result = Future(self.loop)
+        def callback(f):
+            if f._exc_info:
+                if issubclass(f._exc_info[0], (socket.error, ssl.SSLError)):
+                    try:
+                        raise TembooConnectionError('An error occurred connecting to the Temboo server. Verify that your Temboo Account Name is correct, and that you have a functioning network connection')
+                    except TembooConnectionError:
+                        result.set_exception(sys.exc_info())
+                else:
+                    result.set_exception(f._exc_info)
+                return
+            response = f._result
+            try:
+                result.set_result(self._handle_response(response, self._decode_body(response, response.read()), path))
+            except:
+                result.set_exception(sys.exc_info())
+        future.add_done_callback(callback)
+        return result
+
+
+    def get_content_async(self, path, parameters=None):
+        """Does a non-blocking GET request to the server.
+
+        Takes the same arguments as get_content.
+
+        Returns a Future for the server response body, JSON-decoded.
+        """
+        return self._do_request_async('GET', path, parameters=parameters)
+
+
+    def post_async(self, path, body, parameters=None):
+        """Does a non-blocking POST request to the server.
+
+        Takes the same arguments as post.
+
+        Returns a Future for the server response body, JSON-decoded.
+        """
+        return self._do_request_async('POST', path, body, parameters)
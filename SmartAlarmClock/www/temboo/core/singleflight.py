@@ -0,0 +1,95 @@
+###############################################################################
+#
+# temboo.core.singleflight.SingleFlight
+#
+# Sharing one in-flight call between concurrent callers asking for the
+# same thing.
+#
+# Python version 2.6
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+#
+###############################################################################
+
+
+import sys
+import threading
+
+
+class _Call(object):
+    """
+    A call in progress, and its outcome once finished.
+    """
+
+    def __init__(self):
+        self.finished = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Runs at most one call per key at a time. Threads asking for a key
+    that is already being worked on wait for that call and share its
+    result (or exception) instead of starting their own.
+
+    Only calls that overlap in time are shared; nothing is remembered
+    once a call has finished.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Calls func(), unless a call for key is already in flight.
+
+        key  -- a hashable value identifying what func computes.
+        func -- a callable taking no arguments.
+
+        Returns what func returned, or raises what it raised, for every
+        thread that shared the call.
+
+        """
+        self._lock.acquire()
+        try:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+        finally:
+            self._lock.release()
+
+        if leader:
+            try:
+                call.result = func()
+            except:
+                call.exc_info = sys.exc_info()
+            self._lock.acquire()
+            try:
+                del self._calls[key]
+            finally:
+                self._lock.release()
+            call.finished.set()
+        else:
+            call.finished.wait()
+
+        if call.exc_info is not None:
+            raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+        return call.result
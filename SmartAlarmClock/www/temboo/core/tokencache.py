@@ -0,0 +1,126 @@
+###############################################################################
+#
+# temboo.core.tokencache.TokenCache
+#
+# Reuse of OAuth access tokens between choreo executions, so Temboo does
+# not have to refresh the token on every call.
+#
+# Python version 2.6
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+#
+###############################################################################
+
+
+import hashlib
+import os
+import re
+import time
+
+from temboo.core.util import StateFile
+
+
+#Tokens are secrets, so they are kept in the user's own directory rather
+#than the shared temporary directory.
+STATE_FILE = os.path.join(os.path.expanduser('~'), '.temboo', 'tokens.json')
+
+_UNAUTHORIZED = re.compile(r'\b401\b|unauthori[sz]ed|invalid.?credentials|invalid_grant', re.I)
+
+
+def is_unauthorized(text):
+    """
+    Returns True if an error message says the access token was refused.
+
+    """
+    return bool(text) and _UNAUTHORIZED.search(text) is not None
+
+
+class TokenCache(object):
+    """
+    Keeps the OAuth access tokens returned in choreos' NewAccessToken
+    outputs, in a state file shared by all processes on the host.
+
+    A TembooSession with a token_cache passes a cached token as the
+    AccessToken input of later executions that take one, so Temboo can
+    skip refreshing it. If the token is refused the execution is run
+    once more without it, letting Temboo refresh the token again.
+    """
+
+    def __init__(self, lifetime=3300, path=STATE_FILE):
+        """Construct a new TokenCache
+
+        lifetime -- seconds a new token is used for. Google access tokens
+                    expire after an hour, so the default leaves a few
+                    minutes' margin. (default 3300)
+        path     -- the state file. It is created readable by its owner
+                    only, and refused if anyone else could have written
+                    or read it. (default ~/.temboo/tokens.json)
+
+        """
+        self.lifetime = lifetime
+        self.path = path
+        self._state = StateFile(path, private=True)
+
+    def key(self, account, choreo_inputs):
+        """Returns the cache key for an execution's token, or None.
+
+        Tokens are cached per account and credential preset (or
+        RefreshToken input). Input sets without an AccessToken input, or
+        with one already set by the caller, are left alone.
+
+        """
+        if not hasattr(choreo_inputs, 'set_AccessToken') or 'AccessToken' in choreo_inputs.inputs:
+            return None
+        identity = choreo_inputs.preset_uri or choreo_inputs.inputs.get('RefreshToken')
+        if not identity:
+            return None
+        return hashlib.sha1('{0}\n{1}'.format(account, identity)).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the unexpired token stored under key, or None.
+
+        """
+        return self._update(lambda tokens, now: None, key)
+
+    def set(self, key, token):
+        def update(tokens, now):
+            tokens[key] = (token, now + self.lifetime)
+        self._update(update)
+
+    def discard(self, key, token):
+        """
+        Forgets a refused token, unless it has been replaced already.
+
+        """
+        def update(tokens, now):
+            if key in tokens and tokens[key][0] == token:
+                del tokens[key]
+        self._update(update)
+
+    def _update(self, update, key=None):
+        """
+        Applies update(tokens, now) to the stored tokens under an
+        exclusive lock, and returns the unexpired token for key.
+
+        """
+        def apply(tokens):
+            now = time.time()
+            update(tokens, now)
+            for name in [k for k, v in tokens.items() if v[1] <= now]:
+                del tokens[name]
+            if key in tokens:
+                return tokens[key][0]
+            return None
+        return self._state.update(apply)
@@ -24,6 +24,22 @@
 ###############################################################################
 
 
+import errno
+import json
+import os
+import random
+import stat
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    #Without fcntl (e.g. on Windows) state files are only shared safely by
+    #the threads of one process.
+    fcntl = None
+
+
 class ExecutionStatus(object):
     SUCCESS='SUCCESS'
     ERROR='ERROR'
@@ -32,3 +48,124 @@ class ExecutionStatus(object):
     RUNNING='RUNNING'
         
 
+
+def save_json(path, value, **options):
+    """
+    Writes value as JSON to a temporary file next to path and renames it
+    over path, so that readers never see a partially written file. Any
+    options are passed on to json.dump.
+
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        f = os.fdopen(fd, 'w')
+        try:
+            json.dump(value, f, **options)
+        finally:
+            f.close()
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+
+class StateFile(object):
+    """
+    A JSON object in a file shared by all processes on the host, which is
+    read and rewritten under an exclusive lock.
+    """
+
+    def __init__(self, path, mode=0666, private=False):
+        """Construct a new StateFile
+
+        path    -- the file, which is created (along with its directory)
+                   when first updated.
+        mode    -- the permissions the file is created with, less the
+                   umask. (default 0666)
+        private -- True for a file holding secrets. It is created 0600
+                   in a 0700 directory, is never opened through a
+                   symlink, and an existing file is refused unless it
+                   belongs to this user and is 0600. (default False)
+
+        """
+        self.path = path
+        self.mode = 0600 if private else mode
+        self.private = private
+        self._lock = threading.Lock()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0700 if self.private else 0777)
+        flags = os.O_RDWR | os.O_CREAT
+        if self.private:
+            flags |= getattr(os, 'O_NOFOLLOW', 0)
+        fd = os.open(self.path, flags, self.mode)
+        if self.private:
+            st = os.fstat(fd)
+            if ((hasattr(os, 'getuid') and st.st_uid != os.getuid()) or
+                    stat.S_IMODE(st.st_mode) != 0600):
+                os.close(fd)
+                raise IOError(errno.EACCES, 'Refusing to use a state file not private to this user', self.path)
+        return os.fdopen(fd, 'r+')
+
+    def update(self, update):
+        """
+        Calls update(state) with the stored dict, which is empty if the
+        file is new or a write was cut short, then stores the dict again.
+        Returns what update returns.
+
+        """
+        self._lock.acquire()
+        try:
+            f = self._open()
+            try:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    state = json.loads(f.read() or '{}')
+                except ValueError:
+                    state = {}
+                result = update(state)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+                return result
+            finally:
+                #Closing the file releases the flock.
+                f.close()
+        finally:
+            self._lock.release()
+
+
+class PollPolicy(object):
+    """
+    Exponential backoff with jitter for polling the Temboo server.
+    """
+
+    def __init__(self, initial=0.5, factor=2.0, max_interval=30.0, jitter=0.5):
+        """Construct a new PollPolicy
+
+        initial      -- seconds to wait before the first retry. (default 0.5)
+        factor       -- how much the interval grows each time. (default 2)
+        max_interval -- the longest interval, in seconds. (default 30)
+        jitter       -- fraction of each interval that is randomized, so
+                        that many pollers don't hit the server in lock
+                        step. 0 disables jitter. (default 0.5)
+
+        """
+        self.initial = initial
+        self.factor = factor
+        self.max_interval = max_interval
+        self.jitter = jitter
+
+    def delays(self):
+        """
+        Returns an endless generator of wait intervals in seconds.
+
+        """
+        interval = self.initial
+        while True:
+            yield interval * (1 - self.jitter * random.random())
+            interval = min(interval * self.factor, self.max_interval)